@@ -1,9 +1,47 @@
 import os
 import cv2
 import sys
+import time
+import multiprocessing
 
-from plot import plot_evaluation, plot_track, plot_single_values
+from plot import PlotPool, plot_evaluation, plot_track, plot_single_values, plot_curves
 from CycloDetector import *
+from constants import PLOT_WORKERS
+
+
+## the comparer of the worker process, set by init_worker
+_worker_comparer = None
+
+
+def init_worker(comparer, counter, threads):
+    """
+    Initializes a worker process of the pool: every worker has its own detector (and loads its own detectron2 models),
+    and is pinned to its own set of cores with the number of torch and OpenCV threads limited to that set
+    :param comparer:        the CycloComparer with the settings of the comparison
+    :param counter:         shared multiprocessing.Value, used to give every worker an index
+    :param threads:         number of threads (cores) of every worker
+    """
+    global _worker_comparer
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) >= threads * (index + 1):
+            os.sched_setaffinity(0, cores[threads*index:threads*(index+1)])
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_comparer = comparer
+    _worker_comparer.detector = CycloDetector()
+
+
+def analyse_files_worker(args):
+    files, plot_path = args
+    return _worker_comparer.analyse_files(files, plot_path)
 
 
 class CycloComparer:
@@ -13,43 +51,132 @@ class CycloComparer:
     segmentation_folder         =   None
     mask_interest_folder        =   None
     analyse_rate                =   None
+    analyse_rates               =   None
     img_set                     =   None
+    pipelined                   =   None
+    batch_size                  =   None
+    workers                     =   None
+    sampling_budget             =   None
+    roi                         =   None
+    inference_scale             =   None
+    render_every                =   1
+    visualize                   =   True
+    plot_workers                =   PLOT_WORKERS
+    plots                       =   None
 
 
     def __init__(self):
         self.detector = CycloDetector()
 
     
-    def setup(self, data_folder, analyse_rate, pose_estimation_folder=None, segmentation_folder=None, mask_interest_folder=None, img_set=None):        
+    def setup(self, data_folder, analyse_rate, pose_estimation_folder=None, segmentation_folder=None, mask_interest_folder=None, img_set=None, pipelined=False, batch_size=DETECTRON_BATCH_SIZE, workers=1, sampling_budget=None, roi=False, inference_scale=DETECTRON_INFERENCE_SCALE, render_every=1, plot_workers=PLOT_WORKERS):        
         self.data_folder = data_folder
         self.pose_estimation_folder = pose_estimation_folder
         self.segmentation_folder = segmentation_folder
         self.mask_interest_folder = mask_interest_folder
-        self.analyse_rate = int(analyse_rate)
+        self.analyse_rates = rate_list(analyse_rate)
+        self.analyse_rate = self.analyse_rates[-1]
         self.img_set = img_set
+        self.pipelined = pipelined
+        self.batch_size = int(batch_size)
+        self.workers = max(1, int(workers))
+        self.sampling_budget = sampling_budget
+        if self.sampling_budget is not None:
+            # the adaptive sampling selects its frames from the frames of the highest rate
+            self.analyse_rates = [self.analyse_rate]
+        self.roi = roi
+        self.inference_scale = inference_scale
+        # render every Nth frame of the visualizations, 0 for only the summary images
+        self.render_every = int(render_every)
+        self.plot_workers = plot_workers
 
-    def compare(self, visualize=True, plot_path="plots/"):
+    def compare(self, visualize=True, plot_path="plots/", report=False):
+        """
+        :param visualize:       [opt] render the visualizations and the summary images, nothing is drawn without it (headless)
+        :param plot_path:       [opt] folder where the plots, the visualizations and the results of every frame are saved
+        :param report:          [opt] save all plots as the pages of one PDF (report.pdf) instead of separate files
+        """
         if not os.path.exists(plot_path):
             os.mkdir(plot_path)
+        self.visualize = visualize
 
-        import time
         start_comp_time = time.time()
-        area = {}
-        tracing = {}
-        tracing_points = {}
         
         files = sorted(os.listdir(self.data_folder))
         if self.img_set is not None:
             files = [f for f in files if any(ext in f for ext in self.img_set)]
-        
-        for f in files:
-            name = f.split(".")[0]
-            path = os.path.join(self.data_folder, f)
-            self.detector.setup(path,self.analyse_rate, self.pose_estimation_folder, self.segmentation_folder, self.mask_interest_folder)
-            start_an_time = time.time()
-            orientation, a, tracks, angles, vis = self.detector.analyse(vis_path=os.path.join(plot_path,"vis_"+f))
-            end_an_time = time.time()
-            print('\t {:10s} : {:10f}'.format(name, round(end_an_time-start_an_time, 2)))
+
+        # the plots are made by a pool of background processes while the files are analysed (see PlotPool)
+        self.plots = PlotPool(self.plot_workers, os.path.join(plot_path, "report.pdf") if report else None)
+        try:
+            # with several analyse rates the plots of every rate are saved in a separate folder
+            rate_paths = {}
+            for rate in self.analyse_rates:
+                rate_paths[rate] = plot_path
+                if len(self.analyse_rates) > 1:
+                    rate_paths[rate] = os.path.join(plot_path, "rate_" + str(rate))
+                    if not os.path.exists(rate_paths[rate]):
+                        os.mkdir(rate_paths[rate])
+
+            if self.workers > 1:
+                analysed = self.analyse_parallel(files, plot_path)
+            else:
+                analysed = self.iter_analyse_files(files, plot_path)
+            results = []
+            for name, rate_results, an_time in analysed:
+                print('\t {:10s} : {:10f}'.format(name, round(an_time, 2)))
+                for rate in self.analyse_rates:
+                    self.plot_file(name, rate_results[rate], rate, rate_paths[rate], visualize)
+                # the summary images are saved, only the results are kept for the comparison between the files
+                results.append((name, {rate : rate_results[rate][:4] + (None, ) for rate in rate_results}, an_time))
+
+            for rate in self.analyse_rates:
+                self.plot_results([(name, rate_results[rate]) for name, rate_results, an_time in results], rate_paths[rate])
+
+            if len(self.analyse_rates) > 1:
+                self.plot_rates_report(results, plot_path)
+        finally:
+            self.plots.close()
+
+        end_comp_time = time.time()
+        print('COMP_TIME : {:10f}'.format(round(end_comp_time-start_comp_time, 2)))
+
+
+    def plot_file(self, name, result, rate, plot_path, visualize=True):
+        """
+        Queues the plots of the tracks and angles of a file as soon as it is analysed, and saves its summary image
+        :param name:            name of the file
+        :param result:          result of the detector (orientation, area, tracks, angles, visualization)
+        :param rate:            the analyse rate of the result
+        :param plot_path:       folder where the plots are saved
+        :param visualize:       [opt] save the summary image of the file
+        """
+        orientation, a, tracks, angles, vis = result
+        track_pts = {tr : tracks[tr]["points"] for tr in tracks}
+        # with motion-adaptive sampling the frames are not equally spaced in time
+        timestamps = None
+        if self.sampling_budget is not None and len(tracks) > 0:
+            timestamps = tracks[list(tracks.keys())[0]]["timestamps"]
+        self.plots.submit(plot_track, os.path.join(plot_path,"plot_" + orientation + "_" + name + ".png"), track_pts, "Keypoint Tracing Analysis", fps=rate, xlabel="time (seconds)", ylabel="position", timestamps=timestamps)
+
+        if len(angles) > 0:
+            self.plots.submit(plot_single_values, os.path.join(plot_path,"plot_angles" + "_" + name + ".png"), angles, "Angle Analysis", fps=rate, xlabel="time (seconds)", ylabel="angle (degrees)", timestamps=timestamps)
+
+        if visualize and vis is not None:
+            cv2.imwrite(os.path.join(plot_path, name + ".jpg"), vis)
+
+
+    def plot_results(self, results, plot_path):
+        """
+        Queues the comparison of the area and the stability of the keypoints between the files
+        :param results:         list with the name and the result of the detector (orientation, area, tracks, angles, visualization) of every file
+        :param plot_path:       folder where the plots are saved
+        """
+        area = {}
+        tracing = {}
+
+        # the results are merged in the order of the files, so the plots do not depend on the number of workers
+        for name, (orientation, a, tracks, angles, vis) in results:
             if a is not None:
                 area[name] = a
             
@@ -58,26 +185,124 @@ class CycloComparer:
             tracing[orientation][name] = {}
             for tr in tracks:
                 tracing[orientation][name][tr] = tracks[tr]["std"]
-
-            track_pts = {tr : tracks[tr]["points"] for tr in tracks}
-            plot_track(os.path.join(plot_path,"plot_" + orientation + "_" + name + ".png"), track_pts, "Keypoint Tracing Analysis", fps=self.analyse_rate, xlabel="time (seconds)", ylabel="position")
-
-            if len(angles) > 0:
-                plot_single_values(os.path.join(plot_path,"plot_angles" + "_" + name + ".png"), angles, "Angle Analysis", fps=self.analyse_rate, xlabel="time (seconds)", ylabel="angle (degrees)")
-
-            if visualize:
-                cv2.imwrite(os.path.join(plot_path, name + ".jpg"), vis)
         
         if len(area) > 0:
             metric_names = list(area[list(area.keys())[0]])
-            plot_evaluation(os.path.join(plot_path, "plot_area.png"), metric_names, area, "Front Area Analysis")
+            self.plots.submit(plot_evaluation, os.path.join(plot_path, "plot_area.png"), metric_names, area, "Front Area Analysis")
 
         for orientation in tracing:
             metric_names = list(tracing[orientation][list(tracing[orientation].keys())[0]])
-            plot_evaluation(os.path.join(plot_path,"plot_" + orientation + ".png"), metric_names, tracing[orientation], "KPS stability analysis (" + orientation + ")")
+            self.plots.submit(plot_evaluation, os.path.join(plot_path,"plot_" + orientation + ".png"), metric_names, tracing[orientation], "KPS stability analysis (" + orientation + ")")
 
-        end_comp_time = time.time()
-        print('COMP_TIME : {:10f}'.format(round(end_comp_time-start_comp_time, 2)))
+
+    def plot_rates_report(self, results, plot_path):
+        """
+        Compares the metrics of every analyse rate with the metrics of the highest rate, the deviation is printed and plotted per metric
+        :param results:         list with name, results per rate and analysis time of every file (see analyse_files)
+        :param plot_path:       folder where the plot is saved
+        """
+        reference = self.analyse_rates[-1]
+        deviation = {}
+        frames = [0] * len(self.analyse_rates)
+        for name, rate_results, an_time in results:
+            metrics = [rate_metrics(rate_results[rate]) for rate in self.analyse_rates]
+            for i in range(len(self.analyse_rates)):
+                frames[i] += metrics[i].pop("FRAMES")
+            for m in metrics[-1]:
+                ref = metrics[-1][m]
+                deviation.setdefault(m, {})[name] = [abs(met[m] - ref) / abs(ref) if ref != 0 else 0 for met in metrics]
+
+        print('RATES (deviation from {} fps)'.format(reference))
+        for i in range(len(self.analyse_rates)):
+            values = [deviation[m][name][i] for m in deviation for name in deviation[m]]
+            mean_deviation = np.mean(values) * 100 if len(values) > 0 else 0
+            print('\t {:10s} : {:10f} % ({} frames)'.format(str(self.analyse_rates[i]) + " fps", round(mean_deviation, 2), frames[i]))
+
+        if len(deviation) > 0:
+            self.plots.submit(plot_curves, os.path.join(plot_path, "plot_rates.png"), self.analyse_rates, deviation, "Deviation from the analysis at " + str(reference) + " fps", factor=100, xlabel="analyse rate (fps)", ylabel="deviation (%)")
+
+
+    def analyse_files(self, files, plot_path):
+        """
+        Analyses a list of files with the detector, see iter_analyse_files
+        :return:                list with name, results per analyse rate (see CycloDetector.analyse_multi_rate) and analysis time of every file
+        """
+        return list(self.iter_analyse_files(files, plot_path))
+
+
+    def iter_analyse_files(self, files, plot_path):
+        """
+        Analyses a list of files with the detector and yields the name, results per analyse rate and analysis time of every file
+        as soon as it is analysed. The images are first predicted in batches if batch_size > 1.
+        :param files:           list of filenames in data_folder
+        :param plot_path:       folder where the visualizations and the results of every frame (frames_<name>.npy, see FrameStore) are saved
+        """
+        if self.batch_size > 1:
+            images = [os.path.join(self.data_folder, f) for f in files if is_image(f)]
+            for i in range(0, len(images), self.batch_size):
+                self.detector.predict_images(images[i:i+self.batch_size], self.pose_estimation_folder, self.segmentation_folder, self.inference_scale)
+
+        for f in files:
+            name = f.split(".")[0]
+            path = os.path.join(self.data_folder, f)
+            self.detector.setup(path,self.analyse_rates, self.pose_estimation_folder, self.segmentation_folder, self.mask_interest_folder, self.batch_size, self.sampling_budget, self.roi, self.inference_scale, \
+                render_every=max(1, self.render_every), visualize=self.visualize)
+            vis_path = None
+            if self.visualize and self.render_every > 0:
+                vis_path = os.path.join(plot_path,"vis_"+f)
+            start_an_time = time.time()
+            rate_results = self.detector.analyse_multi_rate(vis_path=vis_path, pipelined=self.pipelined)
+            end_an_time = time.time()
+            self.detector.frame_store.save(os.path.join(plot_path, "frames_" + name))
+            yield name, rate_results, end_an_time-start_an_time
+
+
+    def analyse_parallel(self, files, plot_path):
+        """
+        Analyses the files in a pool of worker processes, every video is a separate job and the images are grouped in jobs of batch_size.
+        The results of every file are yielded (see iter_analyse_files) as soon as the job is done and the jobs before it, in the order of files.
+        The pool uses fork, the main scripts are not guarded against being imported again by spawn.
+        :param files:           list of filenames in data_folder
+        :param plot_path:       folder where the visualizations are saved
+        """
+        jobs = []
+        for f in files:
+            if is_image(f) and len(jobs) > 0 and is_image(jobs[-1][-1]) and len(jobs[-1]) < self.batch_size:
+                jobs[-1].append(f)
+            else:
+                jobs.append([f])
+
+        if len(jobs) == 0:
+            return
+        workers = min(self.workers, len(jobs))
+        if hasattr(os, "sched_getaffinity"):
+            cores = len(os.sched_getaffinity(0))
+        else:
+            cores = os.cpu_count()
+        threads = max(1, cores // workers)
+
+        ctx = multiprocessing.get_context("fork")
+        counter = ctx.Value("i", 0)
+        with ctx.Pool(workers, initializer=init_worker, initargs=(self, counter, threads)) as pool:
+            for job_results in pool.imap(analyse_files_worker, [(job, plot_path) for job in jobs]):
+                yield from job_results
+
+
+def rate_metrics(result):
+    """
+    :param result:          result of the detector for one analyse rate (orientation, area, tracks, angles, visualization)
+    :return:                dict with the area metrics, the std of every tracked keypoint, the mean of every angle and the number of frames
+    """
+    orientation, a, tracks, angles, vis = result
+    metrics = {}
+    if a is not None:
+        metrics.update(a)
+    for tr in tracks:
+        metrics[tr + " STD"] = tracks[tr]["std"]
+    for angle in angles:
+        metrics[angle + " MEAN"] = np.mean(angles[angle])
+    metrics["FRAMES"] = len(tracks[list(tracks.keys())[0]]["points"]) if len(tracks) > 0 else 0
+    return metrics
 
 
 #com = CycloComparer()
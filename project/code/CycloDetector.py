@@ -5,14 +5,24 @@ import math
 import sys
 import json
 import shutil
-
-from config import DETECTRON_PATH
-from get_data import get_mask, get_keypoints, get_orientation, get_area, get_angle
-from vis import draw_skeleton, draw_angle
-
-
-IMG_TYPES = [".jpg", ".png", ".jpeg"]
-VID_TYPES = [".mp4", ".mov"]
+import time
+from collections import deque
+
+from config import DETECTRON_BATCH_SIZE, DETECTRON_INFERENCE_SCALE
+from get_data import get_mask, get_keypoints, get_orientation, get_area
+from vis import draw_skeleton
+from area import get_interest_area
+from frame_source import FrameSource, MotionSampler, IMG_TYPES, VID_TYPES, is_image
+from pipeline import FramePrefetcher
+from render import FrameRenderer
+from mask_cache import MaskCache
+from pose_cache import PoseCache
+from inference_cache import InferenceCache
+from roi import roi_from_results
+from running_stats import AnalysisSummary
+from frame_store import FrameStore
+from kinematics import ANGLES, store_points, sequence_kinematics, frame_angles
+from constants import PIPELINE_QUEUE_SIZE, ROI_MARGIN, ROI_MIN_SCORE, KEYPOINTS
 
 
 class CycloDetector:
@@ -24,78 +34,335 @@ class CycloDetector:
     skip_frames                 =   None
     frame_number                =   None
     video_cap                   =   None
+    frame_source                =   None
+    frame_sampler               =   None
+    sampling_budget             =   None
+    frame_index                 =   None
+    timestamp                   =   None
     ANALYSE_RATE                =   None
-    detectron_pose_path         =   os.path.join(DETECTRON_PATH, "pose_estimation")
-    detectron_seg_path          =   os.path.join(DETECTRON_PATH, "segmentation")
+    analyse_rates               =   None
+    rate_skip_frames            =   None
+    inference_cache             =   None
     detectron                   =   None
     pose_file_path              =   None
     pose_kps                    =   None
-    seg_folder_path             =   None
+    mask_cache                  =   None
+    pipeline_stats              =   None
+    batch_size                  =   None
+    frame_buffer                =   None
+    frame_reader                =   None
+    roi_mode                    =   False
+    roi                         =   None
+    inference_scale             =   DETECTRON_INFERENCE_SCALE
+    orientation                 =   None
+    area_bool                   =   None
+    kps_to_track                =   None
+    angles_to_track             =   None
+    first_frame                 =   None
+    summary                     =   None
+    live                        =   False
+    frame_store                 =   None
+    kinematics                  =   None
+    render_every                =   1
+    visualize                   =   True
+    renderer                    =   None
     
     def __init__(self):
         super().__init__()
 
 
-    def setup(self, file_path, analyse_rate, pose_estimation_folder=None, segmentation_folder=None, mask_interest_folder=None):
+    def setup(self, file_path, analyse_rate, pose_estimation_folder=None, segmentation_folder=None, mask_interest_folder=None, batch_size=DETECTRON_BATCH_SIZE, sampling_budget=None, roi=False, inference_scale=DETECTRON_INFERENCE_SCALE, live=False, render_every=1, visualize=True):
+        """
+        :param file_path:       the image or video to analyse
+        :param analyse_rate:    one analyse rate or a list of analyse rates (frames per second)
+        :param batch_size:      [opt] number of frames predicted by detectron2 at once
+        :param sampling_budget: [opt] select the frames based on the motion with this average number of frames per second of video,
+                                the frames are selected from the frames of the highest analyse rate (see MotionSampler)
+        :param roi:             [opt] predict on a crop around the person of the previous frame (see predict_frames)
+        :param inference_scale: [opt] size of the input of detectron2 relative to the default input size of the models
+        :param live:            [opt] the frames come from a live source (see RealtimeAnalyser) and are predicted one by one without the cache
+        :param render_every:    [opt] render every Nth frame of the visualization (see FrameRenderer)
+        :param visualize:       [opt] draw the summary image, without it (headless) nothing is drawn and the summary image is None
+        """
         self.file_path = file_path
         self.file_basename = os.path.basename(file_path).split(".")[0]
         self.pose_estimation_folder = pose_estimation_folder
         self.segmentation_folder = segmentation_folder 
         self.mask_interest_folder = mask_interest_folder
-        self.analyse_rate = int(analyse_rate)
+        self.analyse_rates = rate_list(analyse_rate)
+        self.analyse_rate = self.analyse_rates[-1]
+        self.batch_size = max(1, int(batch_size))
+        self.sampling_budget = sampling_budget
+        if self.sampling_budget is not None:
+            self.analyse_rates = [self.analyse_rate]
+        self.roi_mode = roi
+        self.roi = None
+        self.inference_scale = inference_scale
+        self.live = live
+        self.render_every = max(1, int(render_every))
+        self.visualize = visualize
         self.mask_interest = None 
+        self.interest_area = None
         
         self.frame_number = 0
         self.skip_frames = 1
-        self.video_cap = None
-        if os.path.splitext(self.file_path)[1] in VID_TYPES:
-            self.video_cap = cv2.VideoCapture(self.file_path)
-            fps = self.video_cap.get(cv2.CAP_PROP_FPS)
-            self.skip_frames = max(1, round(fps / self.analyse_rate))
+        self.frame_index = None
+        self.timestamp = None
+        if self.frame_source is not None:
+            self.frame_source.release()
+        self.frame_source = FrameSource(self.file_path)
+        self.video_cap = self.frame_source.video_cap
+        self.rate_skip_frames = {rate : 1 for rate in self.analyse_rates}
+        if self.video_cap is not None:
+            self.rate_skip_frames = {rate : max(1, round(self.frame_source.fps / rate)) for rate in self.analyse_rates}
+            self.skip_frames = self.rate_skip_frames[self.analyse_rate]
+            # only the union of the frames of all rates is decoded and predicted
+            self.frame_source.set_skip_frames(list(self.rate_skip_frames.values()))
+        self.frame_sampler = None
+        self.frame_reader = self.frame_source.read
+        if self.video_cap is not None and self.sampling_budget is not None:
+            self.frame_sampler = MotionSampler(self.frame_source, self.sampling_budget)
+            self.frame_reader = self.frame_sampler.read
+        self.frame_buffer = deque()
         
+        if self.pose_kps is not None:
+            self.pose_kps.close()
         self.pose_kps = None
         self.pose_file_path = None
-        self.seg_folder_path = None
+        if self.mask_cache is not None:
+            self.mask_cache.close()
+        self.mask_cache = None
 
         if self.pose_estimation_folder is None or self.segmentation_folder is None:
-            try:
-                from detectron import Detectron
-                self.detectron = Detectron()
-            except:
-                print("\n\nPLEASE INSTALL DETECTRON2 BEFORE CONTINUING, see the github for more information. Or select pose and segmentation data as a folder.\n")
-                sys.exit(1)
+            self.load_detectron()
+            if self.inference_cache is None and not self.live:
+                self.inference_cache = InferenceCache()
             
-        if self.pose_estimation_folder is None:
-            if not os.path.exists(self.detectron_pose_path):
-                os.makedirs(self.detectron_pose_path)
-            self.pose_file_path = os.path.join(self.detectron_pose_path, self.file_basename + ".json")
-            if os.path.exists(self.pose_file_path):
-                with open(self.pose_file_path) as json_file:
-                    self.pose_kps = json.load(json_file) 
-            else:
-                self.pose_kps = {}
-        if self.segmentation_folder is None:
-            self.seg_folder_path = os.path.join(self.detectron_seg_path, self.file_basename)
-            if not os.path.exists(self.seg_folder_path):
-                os.makedirs(self.seg_folder_path)
+        if self.pose_estimation_folder is None and not self.live:
+            self.pose_kps = self.open_pose_cache(self.file_path)
+            self.pose_file_path = self.pose_kps.path
             
     
-    def analyse(self, vis_path=None):
-        frame, kps, mask = self.get_frame_data()
+    def load_detectron(self):
+        try:
+            from detectron import get_detectron
+            self.detectron = get_detectron()
+        except:
+            print("\n\nPLEASE INSTALL DETECTRON2 BEFORE CONTINUING, see the github for more information. Or select pose and segmentation data as a folder.\n")
+            sys.exit(1)
+
+
+    def open_pose_cache(self, file_path):
+        """
+        Opens the pose cache of a file, the cache is keyed by the content of the file and the keypoint model
+        :param file_path:       the image or video
+        :return:                PoseCache object
+        """
+        return PoseCache(self.inference_cache.entry_path("pose_estimation", file_path, options=self.cache_options(file_path)))
+
+
+    def open_mask_cache(self, file_path):
+        """
+        Opens the mask cache of a file, the cache is keyed by the content of the file and the segmentation model
+        :param file_path:       the image or video
+        :return:                MaskCache object
+        """
+        return MaskCache(self.inference_cache.entry_path("segmentation", file_path, options=self.cache_options(file_path)))
+
+
+    def cache_options(self, file_path):
+        """
+        :return:                the inference options that change the predictions, they are part of the key of the caches
+        """
+        options = {}
+        # an image has no previous frame, so it is always predicted on the full image
+        if self.roi_mode and not is_image(file_path):
+            options["roi"] = [ROI_MARGIN, ROI_MIN_SCORE]
+        if self.inference_scale != 1.0:
+            options["scale"] = self.inference_scale
+        return options
+
+
+    def close_cache(self, cache):
+        """
+        Closes a pose or mask cache and updates its size in the manifest of the inference cache
+        """
+        if cache is not None:
+            cache.close()
+            self.inference_cache.update(cache.path)
+
+
+    def save_cache(self):
+        """
+        Writes the updates of the closed caches to the manifest of the inference cache
+        """
+        if self.inference_cache is not None:
+            self.inference_cache.save()
+
+
+    def predict_images(self, file_paths, pose_estimation_folder=None, segmentation_folder=None, inference_scale=DETECTRON_INFERENCE_SCALE):
+        """
+        Fills the detectron2 cache of a list of still images with one batched inference for the keypoints and one for the masks.
+        Masks are only predicted for images with a FRONT orientation, like in analyse.
+        :param file_paths:              list of image paths
+        :param pose_estimation_folder:  [opt] folder with the pose estimation data, the keypoints are predicted if not given
+        :param segmentation_folder:     [opt] folder with the segmentation data, the masks are predicted if not given
+        :param inference_scale:         [opt] size of the input of detectron2 relative to the default input size of the models
+        """
+        if pose_estimation_folder is not None and segmentation_folder is not None:
+            return
+        self.inference_scale = inference_scale
+        self.load_detectron()
+        if self.inference_cache is None:
+            self.inference_cache = InferenceCache()
+        file_paths = [p for p in file_paths if is_image(p)]
+        basenames = [os.path.basename(p).split(".")[0] for p in file_paths]
+        frames = [cv2.imread(p) for p in file_paths]
+
+        kps_list = [None] * len(file_paths)
+        if pose_estimation_folder is None:
+            todo = []
+            for i in range(len(file_paths)):
+                pose_kps = self.open_pose_cache(file_paths[i])
+                if 0 in pose_kps:
+                    kps_list[i] = pose_kps.get(0)
+                else:
+                    todo.append(i)
+                self.close_cache(pose_kps)
+            if len(todo) > 0:
+                predicted = self.detectron.predict_keypoints_batch([frames[i] for i in todo], scale=self.inference_scale)
+                for i, kps in zip(todo, predicted):
+                    kps_list[i] = kps
+                    pose_kps = self.open_pose_cache(file_paths[i])
+                    pose_kps.put(0, kps)
+                    self.close_cache(pose_kps)
+        else:
+            kps_list = [get_keypoints(os.path.join(pose_estimation_folder, b + ".json")) for b in basenames]
+
+        if segmentation_folder is None:
+            todo = []
+            caches = {}
+            for i in range(len(file_paths)):
+                if kps_list[i] is not None and get_orientation(kps_list[i]) == "FRONT":
+                    caches[i] = self.open_mask_cache(file_paths[i])
+                    if 0 not in caches[i]:
+                        todo.append(i)
+            if len(todo) > 0:
+                masks = self.detectron.predict_mask_panoptic_batch([frames[i] for i in todo], scale=self.inference_scale)
+                for i, mask in zip(todo, masks):
+                    caches[i].put(0, mask)
+            for i in caches:
+                self.close_cache(caches[i])
+        self.save_cache()
+
+
+    def analyse(self, vis_path=None, pipelined=False):
+        """
+        Analyses the file at the (highest) analyse rate, see analyse_multi_rate
+        :return:                orientation, area results, keypoint tracks, angles and the summary image
+        """
+        return self.analyse_multi_rate(vis_path, pipelined)[self.analyse_rate]
+
+
+    def analyse_multi_rate(self, vis_path=None, pipelined=False):
+        """
+        Analyses the file for every analyse rate in one pass, the frames of the lower rates are a subset of the frames that are read.
+        The visualization contains the frames of the highest rate.
+        The results of every frame are kept in frame_store (see FrameStore), the kinematics of every analyse rate
+        (angles, angular velocities, tracked positions and velocities of all keypoints) in kinematics (see sequence_kinematics).
+        :return:                dict of every analyse rate mapped on orientation, area results, keypoint tracks, angles and the summary image
+        """
+        self.frame_store = FrameStore()
+        summaries = None
+        for res in self.iter_analyse(vis_path, pipelined):
+            if summaries is None:
+                summaries = {rate : AnalysisSummary(self.area_bool, self.angles_to_track, self.kps_to_track, self.frame_sampler is not None) for rate in self.analyse_rates}
+            self.frame_store.append(res)
+            for rate in self.analyse_rates:
+                if res["frame"] % self.rate_skip_frames[rate] == 0:
+                    summaries[rate].update(res)
+        self.frame_store.meta = self.frame_store_meta()
+
+        rows = self.frame_store.rows()
+        rate_results = {}
+        self.kinematics = {}
+        for rate in self.analyse_rates:
+            skip_frames = self.rate_skip_frames[rate]
+            rate_rows = rows[rows["frame"] % skip_frames == 0]
+            self.kinematics[rate] = sequence_kinematics(store_points(rate_rows), rate_rows["timestamp"])
+            first_frame = None if self.first_frame is None else np.copy(self.first_frame)
+            rate_results[rate] = (self.orientation, ) + self.analyse_end(rate_rows, self.kinematics[rate], summaries[rate], self.area_bool, self.angles_to_track, self.kps_to_track, first_frame)
+
+        return rate_results
+
+
+    def iter_analyse(self, vis_path=None, pipelined=False):
+        """
+        Analyses the file and yields the result of every analysed frame as soon as it is available (see analyse_frame):
+        the frame number, timestamp, keypoints, tracked keypoints and angles, and the area for a FRONT orientation.
+        The orientation, area_bool, kps_to_track, angles_to_track and first_frame are set before the first result is yielded,
+        the running statistics of the frames so far are kept in summary (see AnalysisSummary).
+        The visualization is rendered in a separate process (see FrameRenderer), it is written and the caches are closed
+        when the last frame is analysed or when the generator is closed.
+        :param vis_path:        [opt] filename of the visualization (video or image), no frames are rendered without it
+        :param pipelined:       [opt] decode, analyse and write the visualization in separate threads (see analyse_pipelined)
+        """
+        frame, kps, _ = self.get_frame_data(get_kps_flag=True, get_mask_flag=False)
+        mask = self.start_analysis(frame, kps)
+        
+        self.start_visualize(vis_path, frame.shape)
 
-        temp = draw_skeleton(frame, kps, mask)
-        orientation = get_orientation(kps, temp)
+        frames = None
+        try:
+            if pipelined:
+                frames = self.analyse_pipelined(frame, kps, mask, self.area_bool, self.angles_to_track, self.kps_to_track)
+            else:
+                frames = self.analyse_serial(frame, kps, mask, self.area_bool, self.angles_to_track, self.kps_to_track)
+            for res in frames:
+                self.summary.update(res)
+                yield res
+        finally:
+            if frames is not None:
+                frames.close()
+            self.stop_visualize()
+            self.save_kps()
+            self.close_cache(self.mask_cache)
+            self.save_cache()
+
+
+    def start_analysis(self, frame, kps, mask=None):
+        """
+        Decides the orientation on the keypoints of the first frame and the keypoints, angles and area that are analysed in the other frames.
+        Sets orientation, area_bool, kps_to_track, angles_to_track, the summary image first_frame (None when headless) and a new summary.
+        The mask of the first frame is only read or predicted when the area is analysed (FRONT orientation).
+        :param frame:           the first frame
+        :param kps:             keypoints of the first frame
+        :param mask:            [opt] mask of the first frame, it is read or predicted when it is needed and not given
+        :return:                the mask of the first frame, None when the area is not analysed
+        """
+        orientation = get_orientation(kps)
+
+        area_bool = orientation == "FRONT"
+        if not area_bool:
+            mask = None
+        elif mask is None:
+            # the mask is predicted on the full frame like the keypoints of the first frame
+            self.roi = None
+            _, mask = self.get_frame_results(frame, get_kps_flag=False, get_mask_flag=True)
+            if self.roi_mode:
+                self.roi = roi_from_results(kps, mask, frame.shape)
     
-        first_frame = np.copy(frame)
-        first_frame = draw_skeleton(first_frame, kps, mask, self.mask_interest)
+        first_frame = None
+        if self.visualize:
+            first_frame = np.copy(frame)
+            first_frame = draw_skeleton(first_frame, kps, mask, self.mask_interest)
         
-        area_bool = False
         kps_to_track = []
         angles_to_track = []
         if self.mask_interest_folder is not None:
-            self.mask_interest = get_mask(os.path.join(self.mask_interest_folder, orientation + ".jpg"))
+            self.interest_area = get_interest_area(self.mask_interest_folder, orientation)
+            self.mask_interest = self.interest_area.mask_interest
         if orientation == "FRONT":
-            area_bool = True
             kps_to_track = ["Neck", "LShoulder", "RShoulder", "RKnee", "LKnee"]
         elif orientation == "L-SIDE":
             kps_to_track = ["LHip", "LShoulder", "LKnee"]
@@ -103,58 +370,155 @@ class CycloDetector:
         else:
             kps_to_track = ["RHip", "RShoulder", "RKnee"]
             angles_to_track = ["RHip_Angle", "RKnee_Angle", "RShoulder_Angle", "RElbow_Angle"]
-        
-        angles = {}
-        track = {}
-        for kp in kps_to_track:
-            track[kp] = []
-        for angle in angles_to_track:
-            angles[angle] = []
-        
-        self.start_visualize(vis_path)
 
-        results = []
+        self.orientation = orientation
+        self.area_bool = area_bool
+        self.kps_to_track = kps_to_track
+        self.angles_to_track = angles_to_track
+        self.first_frame = first_frame
+        self.summary = AnalysisSummary(area_bool, angles_to_track, kps_to_track, self.frame_sampler is not None)
+        return mask
+
+
+    def analyse_serial(self, frame, kps, mask, area_bool, angles_to_track, kps_to_track):
+        """
+        Analyses the remaining frames one by one and yields the result of every frame
+        """
         while frame is not None:
 
-            res, vis = self.analyse_frame(frame, kps, mask, area_bool, angles_to_track, kps_to_track)
-            results.append(res)
-            self.append_visualize(vis)
+            res = self.analyse_frame(frame, kps, mask, area_bool, angles_to_track, kps_to_track)
+            if self.is_visualize_frame():
+                self.append_visualize(frame, kps)
+            yield res
             frame, kps, mask = self.get_frame_data(get_kps_flag=True, get_mask_flag=area_bool)    
 
-        self.stop_visualize()
-        
-        
+
+    def analyse_end(self, rows, kinematics, summary, area_bool, angles_to_track, kps_to_track, first_frame):
+        """
+        Calculates the results over all analysed frames
+        With motion-adaptive sampling the frames are weighted by the time they represent.
+        :param rows:            structured array with the results of the analysed frames (see FrameStore), the tracks and velocities of
+                                the results contain every analysed frame, so they are read from the frame store and not from the summary
+        :param kinematics:      kinematics of the analysed frames (see sequence_kinematics)
+        :param summary:         running statistics of the analysed frames (see AnalysisSummary)
+        :return:                area results, keypoint tracks (with the timestamps and velocities of the points), angles and the summary image
+        """
+        timestamps = rows["timestamp"]
+        stats = summary.values()
+
         area_r = None
         if area_bool:
-            area = {
-                "area": [r["area"] for r in results],
-                "area_interest": [r["area_interest"] for r in results],
-            }
-            area_r, first_frame = self.analyse_area_end(area, first_frame)
-
-        t = np.array([r["kps_to_track"] for r in results])
-        track = {kps_to_track[i] : t[:,i] for i in range(len(kps_to_track))}
-        t = np.array([r["angles_to_track"] for r in results])
-        angles = {angles_to_track[i] : t[:,i] for i in range(len(angles_to_track))}
-        
-        kps_r, first_frame = self.analyse_keypoints_end(track, first_frame)
-        cv2.putText(first_frame, self.file_basename, (10, 50), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 0, 255), 1)
-
-        self.save_kps()
+            area_r, first_frame = self.analyse_area_end(stats["area"], first_frame)
 
-        return orientation, area_r, kps_r, angles, first_frame
+        track = {kp : kinematics["positions"][:, KEYPOINTS.index(kp)] for kp in kps_to_track}
+        angles = {angle : kinematics["angles"][:, ANGLES.index(angle)] for angle in angles_to_track}
+        
+        kps_r, first_frame = self.analyse_keypoints_end(track, stats["kps"], first_frame)
+        for kp in kps_r:
+            kps_r[kp]["timestamps"] = timestamps
+            kps_r[kp]["velocity"] = kinematics["velocity"][:, KEYPOINTS.index(kp)]
+        if first_frame is not None:
+            cv2.putText(first_frame, self.file_basename, (10, 50), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 0, 255), 1)
+
+        return area_r, kps_r, angles, first_frame
+
+
+    def frame_store_meta(self):
+        """
+        :return:                dict with the metadata of the analysis that is saved with the frame store
+        """
+        return {
+            "file"              :   os.path.basename(self.file_path),
+            "fps"               :   self.frame_source.fps,
+            "orientation"       :   self.orientation,
+            "analyse_rates"     :   self.analyse_rates,
+            "rate_skip_frames"  :   {str(rate) : self.rate_skip_frames[rate] for rate in self.rate_skip_frames},
+            "kps_to_track"      :   self.kps_to_track,
+            "angles_to_track"   :   self.angles_to_track,
+            "sampling_budget"   :   self.sampling_budget,
+            "roi"               :   self.roi_mode,
+            "inference_scale"   :   self.inference_scale,
+        }
+
+
+    def is_visualize_frame(self):
+        # the visualization only contains the frames of the highest analyse rate
+        return self.frame_index % self.skip_frames == 0
+
+
+    def analyse_pipelined(self, frame, kps, mask, area_bool, angles_to_track, kps_to_track):
+        """
+        Analyses the remaining frames with the decoding in a separate thread and the rendering of the visualization in a separate process,
+        and yields the result of every frame.
+        The frames go through bounded queues in order, so the results and the visualization are identical to analyse_serial.
+        The utilization of every stage is saved in pipeline_stats when all frames are analysed,
+        the write stage is the time the analysis spends on handing the frames to the renderer.
+        """
+        source = self.frame_sampler if self.frame_sampler is not None else self.frame_source
+        prefetcher = FramePrefetcher(source, PIPELINE_QUEUE_SIZE)
+        start_time = time.time()
+        busy_time = 0.0
+        n_frames = 0
+        prefetcher.start()
+        self.frame_reader = prefetcher.get
+        try:
+            while frame is not None:
+                start = time.time()
+                res = self.analyse_frame(frame, kps, mask, area_bool, angles_to_track, kps_to_track)
+                n_frames += 1
+                busy_time += time.time() - start
+                if self.is_visualize_frame():
+                    self.append_visualize(frame, kps)
+                yield res
+
+                frame, self.frame_index, self.timestamp = self.read_frame()
+                if frame is not None:
+                    start = time.time()
+                    kps, mask = self.get_frame_results(frame, get_kps_flag=True, get_mask_flag=area_bool)
+                    busy_time += time.time() - start
+        finally:
+            self.frame_reader = source.read
+            prefetcher.stop()
+
+        total_time = max(time.time() - start_time, 1e-9)
+        self.pipeline_stats = {
+            "frames"            :   n_frames,
+            "time"              :   total_time,
+            "decode"            :   prefetcher.busy_time / total_time,
+            "inference"         :   busy_time / total_time,
+            "write"             :   (self.renderer.busy_time if self.renderer is not None else 0.0) / total_time,
+        }
+
+
+    def read_frame(self):
+        """
+        Reads the next frame, frames that were read ahead for batched inference are returned first
+        :return:                frame, frame_number, timestamp or None, None, None at the end
+        """
+        if len(self.frame_buffer) > 0:
+            return self.frame_buffer.popleft()
+        return self.frame_reader()
 
 
     def get_frame_data(self, get_kps_flag=True, get_mask_flag=True):
-        frame, kps, mask = None, None, None
-        
-        if self.video_cap is None and self.frame_number == 0:
-            frame = cv2.imread(self.file_path)
-        elif self.video_cap is not None:
-            self.video_cap.set(cv2.CAP_PROP_POS_FRAMES, self.frame_number)
-            ret, frame = self.video_cap.read()
+        frame, self.frame_index, self.timestamp = self.read_frame()
         if frame is None:
             return None, None, None
+        kps, mask = self.get_frame_results(frame, get_kps_flag, get_mask_flag)
+        return frame, kps, mask
+
+
+    def get_frame_results(self, frame, get_kps_flag=True, get_mask_flag=True):
+        """
+        Reads or predicts the keypoints and the mask of a frame. The frames that are read ahead for the keypoints only get
+        their masks predicted in the same batch when the mask is requested, i.e. once the orientation is known to be FRONT.
+        The mask cache is opened on the first requested mask, so no entry is made for a side video.
+        :return:                keypoints and mask of the frame (None when not requested)
+        """
+        kps, mask = None, None
+        self.frame_number = self.frame_index
+        if get_mask_flag and self.mask_cache is None and self.segmentation_folder is None and not self.live:
+            self.mask_cache = self.open_mask_cache(self.file_path)
 
         # kps
         if get_kps_flag:
@@ -163,13 +527,12 @@ class CycloDetector:
                 if self.video_cap is None:
                     path = os.path.join(self.pose_estimation_folder, self.file_basename + ".json")
                 kps = get_keypoints(path)
+            elif self.live:
+                kps = self.detectron.predict_keypoints_batch([frame], self.frame_rois(1), self.inference_scale)[0]
             else:
-                key = str(self.frame_number).zfill(10)
-                if key in self.pose_kps:
-                    kps = self.pose_kps[key]
-                else:
-                    kps = self.predict_kps(frame) 
-                    self.pose_kps[key] = kps
+                if self.frame_number not in self.pose_kps:
+                    self.predict_frames(frame, get_kps_flag=True, get_mask_flag=get_mask_flag and self.segmentation_folder is None)
+                kps = self.pose_kps.get(self.frame_number)
         
         # mask
         if get_mask_flag:
@@ -178,65 +541,96 @@ class CycloDetector:
                 if self.video_cap is None:
                     path = os.path.join(self.segmentation_folder, self.file_basename + ".jpg")
                 mask = get_mask(path)
+            elif self.live:
+                mask = self.detectron.predict_mask_panoptic_batch([frame], self.frame_rois(1), self.inference_scale)[0]
             else:
-                mask_path = os.path.join(self.seg_folder_path, str(self.frame_number).zfill(10) + ".jpg")
-                if os.path.exists(mask_path):
-                    mask = get_mask(mask_path)
-                else:
-                    mask = self.predict_mask(frame)
-                    cv2.imwrite(mask_path, mask)
-
-        self.frame_number += self.skip_frames
-        return frame, kps, mask
+                if self.frame_number not in self.mask_cache:
+                    self.predict_frames(frame, get_kps_flag=False, get_mask_flag=True)
+                mask = self.mask_cache.get(self.frame_number)
+
+        if self.roi_mode:
+            self.roi = roi_from_results(kps, mask, frame.shape)
+        return kps, mask
+
+
+    def predict_frames(self, frame, get_kps_flag=True, get_mask_flag=True):
+        """
+        Reads ahead up to batch_size frames and predicts the keypoints and masks that are not cached yet in one batch.
+        The keypoints are added to pose_kps, the masks are added to the mask cache.
+        In roi mode every frame of the batch is predicted on a crop around the person of the last analysed frame,
+        frames where the person is not found with enough confidence in the crop are predicted again on the full frame.
+        :param frame:           the current frame (frame_number)
+        :param get_kps_flag:    [opt] predict the keypoints
+        :param get_mask_flag:   [opt] predict the masks
+        """
+        while len(self.frame_buffer) < self.batch_size - 1 and (len(self.frame_buffer) == 0 or self.frame_buffer[-1][0] is not None):
+            self.frame_buffer.append(self.frame_reader())
+        batch = [(frame, self.frame_number)] + [(f, n) for f, n, t in self.frame_buffer if f is not None]
 
+        if get_kps_flag:
+            todo = [(f, n) for f, n in batch if n not in self.pose_kps]
+            if len(todo) > 0:
+                kps_list = self.detectron.predict_keypoints_batch([f for f, n in todo], self.frame_rois(len(todo)), self.inference_scale)
+                for (f, n), kps in zip(todo, kps_list):
+                    self.pose_kps.put(n, kps)
 
-    def analyse_frame(self, frame, kps, mask, area_bool=True, angles_to_track=[], kps_to_track=[], visualize=True):
-        res = {}
+        if get_mask_flag:
+            todo = [(f, n) for f, n in batch if n not in self.mask_cache]
+            if len(todo) > 0:
+                masks = self.detectron.predict_mask_panoptic_batch([f for f, n in todo], self.frame_rois(len(todo)), self.inference_scale)
+                for (f, n), mask in zip(todo, masks):
+                    self.mask_cache.put(n, mask)
+
+
+    def frame_rois(self, n_frames):
+        """
+        :return:                list with the region of interest of every frame in roi mode (the crop around the person of the last analysed frame), None otherwise
+        """
+        if self.roi_mode:
+            return [self.roi] * n_frames
+        return None
+
+
+    def analyse_frame(self, frame, kps, mask, area_bool=True, angles_to_track=[], kps_to_track=[]):
+        """
+        Analyses one frame, nothing is drawn on the frame (see FrameRenderer)
+        :return:                dict with the frame number, timestamp, keypoints, tracked keypoints, all angles and the tracked angles,
+                                and the area and the area of interest with area_bool
+        """
+        res = {"frame" : self.frame_index, "timestamp" : self.timestamp, "keypoints" : kps}
         if area_bool:
             a, a_i = self.analyse_area_mask(mask)
             res["area"] = a
             res["area_interest"] = a_i
         res["kps_to_track"] = [ [round(kps[kp][0], 0), round(kps[kp][1], 0)] for kp in kps_to_track ]
-        res["angles_to_track"] = [ get_angle(angle, kps) for angle in angles_to_track ]   
-        
-        if visualize:
-            cv2.putText(frame, self.file_basename, (10, 50), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 0, 255), 1)
-            for angle in angles_to_track:
-                frame = draw_angle(angle, kps, frame)
-            #frame = draw_skeleton(frame, kps, mask, self.mask_interest)
+        # the angles of missing keypoints are NaN
+        res["angles"] = frame_angles(kps)
+        res["angles_to_track"] = [ res["angles"][angle] for angle in angles_to_track ]   
 
-
-        return res, frame
+        return res
 
 
     def predict_kps(self, frame):
         return self.detectron.predict_keypoints(frame)
     
     def save_kps(self):
-        if self.pose_file_path is not None:
-            import json
-            with open(self.pose_file_path, 'w') as json_file:
-                json.dump(self.pose_kps, json_file)
+        # the keypoints are appended to the pose cache as soon as they are predicted
+        self.close_cache(self.pose_kps)
 
     def predict_mask(self, frame):
         return self.detectron.predict_mask_panoptic(frame)
 
     def analyse_area_mask(self, mask):
-        a = get_area(mask)
-        a_i = 0
-        if self.mask_interest is not None:
-            interest = self.mask_interest & mask
-            a_i = get_area(interest)
-        return a, a_i
-
-    def analyse_area_end(self, area, img):
-        res = {}
-        if len(area["area"]) > 0:
-            res["AREA_MEAN"] = np.mean(area["area"])
-            res["AREA_STD"] = np.std(area["area"])
-        if len(area["area_interest"]) > 0:
-            res["AREA_INTEREST_MEAN"] = int(round(np.mean(area["area_interest"])))
-            res["AREA_INTEREST_STD"] = np.std(area["area_interest"])
+        if self.interest_area is not None:
+            return self.interest_area.area(mask)
+        return get_area(mask), 0
+
+    def analyse_area_end(self, stats, img):
+        """
+        :param stats:           mean and std of the area and the area of interest (see AnalysisSummary.values)
+        """
+        res = dict(stats)
+        res["AREA_INTEREST_MEAN"] = int(round(stats["AREA_INTEREST_MEAN"]))
 
         if img is not None:
             cv2.putText(img, "Area Mean:   {:7d}".format(int(res["AREA_MEAN"])), (10, 100), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 255, 255), 1)
@@ -246,47 +640,54 @@ class CycloDetector:
 
         return res, img
 
-    def analyse_keypoints_end(self, track, img):
+    def analyse_keypoints_end(self, track, stats, img):
+        """
+        :param track:           dict with the points of every tracked keypoint
+        :param stats:           center, mean, std and maximum of the distances to the center of every tracked keypoint (see PointSpread)
+        """
         tracks = {}
         for kp in track:
             points = np.array(track[kp])
-            center = [np.mean(points[:,0]) , np.mean(points[:,1])] 
-            dist = []
-            for p in points:
-                d = np.linalg.norm(center-p)
-                dist.append(d)
-            mean = np.mean(dist)
-            std = np.std(dist)
-            tracks[kp] = { "center" : center, "mean" : mean, "std" : std, "points": points}
+            center = stats[kp]["center"]
+            tracks[kp] = { "center" : center, "mean" : stats[kp]["mean"], "std" : stats[kp]["std"], "points": points}
             if img is not None:
-                img = cv2.circle(img, (int(round(center[0])), int(round(center[1]))), int(math.ceil(max(dist))), (255, 255, 255), 2)
+                img = cv2.circle(img, (int(round(center[0])), int(round(center[1]))), int(math.ceil(stats[kp]["max"])), (255, 255, 255), 2)
 
-            
-            points = points.astype(int)
-            points = np.array([ [p] for p in points])
-            cv2.drawContours(img, points, -1, (0, 0, 255), 3)
+                points = points.astype(int)
+                points = np.array([ [p] for p in points])
+                cv2.drawContours(img, points, -1, (0, 0, 255), 3)
 
         return tracks, img
     
-    def start_visualize(self, vis_path):
-        self.writer = None
+    def start_visualize(self, vis_path, shape):
+        """
+        Starts the renderer of the visualization, a video at the analyse rate for a video and an image for an image
+        :param vis_path:        filename of the visualization, None to render nothing
+        :param shape:           shape of the frames
+        """
+        self.renderer = None
         self.vis_path = vis_path
-        if self.vis_path is not None and self.video_cap is not None:
-            frame_width = int(self.video_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(self.video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = self.analyse_rate
-            self.writer = cv2.VideoWriter(vis_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
-            
-    def append_visualize(self, frame):
         if self.vis_path is not None:
-            if self.writer is not None:
-                self.writer.write(frame)
-            else:
-                cv2.imwrite(self.vis_path, frame)
+            fps = self.analyse_rate if self.video_cap is not None else None
+            self.renderer = FrameRenderer(vis_path, fps, shape, self.file_basename, self.angles_to_track, self.render_every)
+            
+    def append_visualize(self, frame, kps):
+        if self.renderer is not None:
+            self.renderer.put(frame, kps)
 
     def stop_visualize(self):
-        if self.vis_path is not None and self.writer is not None:
-            self.writer.release()
+        if self.renderer is not None:
+            self.renderer.close()
+
+
+def rate_list(analyse_rate):
+    """
+    :param analyse_rate:    one analyse rate or a list of analyse rates
+    :return:                sorted list of the unique analyse rates
+    """
+    if isinstance(analyse_rate, (list, tuple)):
+        return sorted(set(int(r) for r in analyse_rate))
+    return [int(analyse_rate)]
 
 
 #det = CycloDetector()
@@ -0,0 +1,57 @@
+import os
+import cv2
+import numpy as np
+
+from get_data import get_mask, get_area
+
+
+class InterestArea:
+    """
+    Mask of the area of interest, cropped to the bounding box of the region so the intersection
+    with a segmentation mask only has to be counted inside that box
+    """
+    mask_interest               =   None
+    box                         =   None
+    crop                        =   None
+
+    def __init__(self, mask_interest):
+        super().__init__()
+        self.mask_interest = mask_interest
+        points = cv2.findNonZero(mask_interest)
+        x, y, w, h = cv2.boundingRect(points) if points is not None else (0, 0, 0, 0)
+        self.box = (x, y, x + w, y + h)
+        self.crop = np.ascontiguousarray(mask_interest[y:y+h, x:x+w])
+
+    def intersection(self, mask):
+        """
+        Calculates the area of the intersection between the area of interest and a mask
+        :param mask:            a black and white image representing a segmentation mask
+        :return:                the number of pixels of the mask inside the area of interest
+        """
+        x1, y1, x2, y2 = self.box
+        if x2 == x1 or y2 == y1:
+            return 0
+        return cv2.countNonZero(cv2.bitwise_and(mask[y1:y2, x1:x2], self.crop))
+
+    def area(self, mask):
+        """
+        :param mask:            a black and white image representing a segmentation mask
+        :return:                a, a_i: the area of the mask and the area inside the area of interest
+        """
+        return get_area(mask), self.intersection(mask)
+
+
+_interest_areas = {}
+
+
+def get_interest_area(mask_interest_folder, orientation):
+    """
+    Returns the area of interest for an orientation, the mask is read and cropped only once per process
+    :param mask_interest_folder:    folder with a mask image for every orientation (e.g. FRONT.jpg)
+    :param orientation:             string value in [FRONT, L-SIDE, R-SIDE]
+    :return:                        InterestArea object
+    """
+    path = os.path.join(mask_interest_folder, orientation + ".jpg")
+    if path not in _interest_areas:
+        _interest_areas[path] = InterestArea(get_mask(path))
+    return _interest_areas[path]
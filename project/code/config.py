@@ -5,4 +5,23 @@ ANALYSE_RATE = 1
 DETECTRON_DEVICE = "cpu"
 #DETECTRON_DEVICE = "cuda"
 DETECTRON_PATH = "/home/brecht/Videos/THESIS_VIDEOS/detectron2_cpu/"
-#DETECTRON_PATH = "/content/detectron2_cuda/"
\ No newline at end of file
+#DETECTRON_PATH = "/content/detectron2_cuda/"
+
+# number of frames (or images) that are predicted by detectron2 in one batch
+DETECTRON_BATCH_SIZE = 1
+
+# size of the input of detectron2 relative to the default input size of the models (e.g. 0.5 on a cpu), part of the key of the detectron2 cache
+DETECTRON_INFERENCE_SCALE = 1.0
+
+# model zoo config and score threshold of every detectron2 predictor, part of the key of the detectron2 cache
+PREDICTOR_CONFIGS = {
+    "mask"      :   ("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml", 0.5),
+    "keypoints" :   ("COCO-Keypoints/keypoint_rcnn_R_50_FPN_3x.yaml", 0.7),
+    "panoptic"  :   ("COCO-PanopticSegmentation/panoptic_fpn_R_101_3x.yaml", None),
+}
+
+# maximum size of the detectron2 cache in bytes, the least recently used videos are removed first (None: no limit)
+DETECTRON_CACHE_MAX_SIZE = 50 * 1024**3
+
+# entries of the detectron2 cache that are used or written less than this number of seconds ago are never removed (another process can be reading them)
+DETECTRON_CACHE_GRACE = 60 * 60
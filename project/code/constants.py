@@ -2,6 +2,20 @@ STD_FRONT_THRESHOLD = 10
 DEFAULT_MASK_SHAPE = (720, 1280, 1)
 KPS_DIST_THRESHOLD = 5
 MASK_BOX_EXPAND = 0.05
+MASK_BATCH_SIZE = 16
+VIDEO_GOP_SIZE = 250
+PIPELINE_QUEUE_SIZE = 8
+EVALUATE_CHUNK_SIZE = 64
+SAMPLING_DIFF_WIDTH = 64
+SAMPLING_MOTION_THRESHOLD = 4.0
+SAMPLING_MAX_INTERVAL = 1.0
+ROI_MARGIN = 0.25
+ROI_MIN_SCORE = 0.9
+ROI_BORDER = 2
+REALTIME_LATENCY_TARGET = 0.5
+REALTIME_LATENCY_WINDOW = 10000
+FRAME_STORE_CAPACITY = 1024
+PLOT_WORKERS = 4
 
 
 KEYPOINTS  =    ["Nose","Neck","RShoulder","RElbow","RWrist","LShoulder","LElbow","LWrist","RHip","RKnee","RAnkle","LHip","LKnee","LAnkle","REye","LEye","REar","LEar"]
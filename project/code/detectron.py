@@ -6,6 +6,7 @@ setup_logger()
 
 # import some common libraries
 import numpy as np
+import torch
 import cv2
 import random
 
@@ -15,11 +16,56 @@ from detectron2.engine import DefaultPredictor
 from detectron2.config import get_cfg
 from detectron2.utils.visualizer import Visualizer
 from detectron2.data import MetadataCatalog
+from detectron2.data import transforms as T
 
 #import other utilities
-import os
+import time
+
+from config import DETECTRON_DEVICE, PREDICTOR_CONFIGS
+from constants import ROI_MIN_SCORE
+from roi import crop, shift_keypoints, paste_mask, touches_border
+
+
+## process-wide registry of the loaded predictors, every model is loaded only once
+_predictors = {}
+load_times = {}
+
+
+def get_predictor(name, device=DETECTRON_DEVICE):
+    """
+    Returns the config and predictor of a model, the model is loaded the first time it is requested
+    :param name:            key of the model in PREDICTOR_CONFIGS
+    :param device:          [opt] the device used for inference (cpu or cuda)
+    :return:                cfg, predictor
+    """
+    key = (name, device)
+    if key not in _predictors:
+        start = time.time()
+        config_file, score_threshold = PREDICTOR_CONFIGS[name]
+        cfg = get_cfg()
+        cfg.MODEL.DEVICE = device
+        cfg.merge_from_file(model_zoo.get_config_file(config_file))
+        if score_threshold is not None:
+            cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = score_threshold  # set threshold for this model
+        cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(config_file)
+        _predictors[key] = (cfg, DefaultPredictor(cfg))
+        load_times[key] = time.time() - start
+        print('LOAD {:10s}: {:10f}'.format(name, round(load_times[key], 2)))
+    return _predictors[key]
+
+
+_detectron = None
+
+
+def get_detectron():
+    """
+    Returns the Detectron object that is shared by all detectors in the process
+    """
+    global _detectron
+    if _detectron is None:
+        _detectron = Detectron()
+    return _detectron
 
-from config import DETECTRON_DEVICE
 
 class Detectron:
 
@@ -34,71 +80,207 @@ class Detectron:
     def __init__(self):
         super().__init__()
         self.device = DETECTRON_DEVICE
-        self.setup_kps_predictor()
-        #self.setup_mask_predictor()
-        self.setup_pan_predictor()
+        # the predictors are loaded lazily the first time they are used
 
     def setup_mask_predictor(self):
         ## INSTANCE SEGMENTATION
-        self.mask_cfg = get_cfg()
-        self.mask_cfg.MODEL.DEVICE=self.device
-        # add project-specific config (e.g., TensorMask) here if you're not running a model in detectron2's core library
-        self.mask_cfg.merge_from_file(model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
-        self.mask_cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5  # set threshold for this model
-        # Find a model from detectron2's model zoo. You can use the https://dl.fbaipublicfiles... url as well
-        self.mask_cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-        self.mask_predictor = DefaultPredictor(self.mask_cfg)
+        self.mask_cfg, self.mask_predictor = get_predictor("mask", self.device)
 
 
     def setup_kps_predictor(self):
         ## KEYPOINTS
         # Inference with a keypoint detection model
-        self.kps_cfg = get_cfg()
-        self.kps_cfg.MODEL.DEVICE=self.device
-        self.kps_cfg.merge_from_file(model_zoo.get_config_file("COCO-Keypoints/keypoint_rcnn_R_50_FPN_3x.yaml"))
-        self.kps_cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.7  # set threshold for this model
-        self.kps_cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-Keypoints/keypoint_rcnn_R_50_FPN_3x.yaml")
-        self.kps_predictor = DefaultPredictor(self.kps_cfg)
+        self.kps_cfg, self.kps_predictor = get_predictor("keypoints", self.device)
 
 
     def setup_pan_predictor(self):
         ## PANOPTIC SEGMENTATION
         # Inference with a panoptic segmentation model
-        self.pan_cfg = get_cfg()
-        self.pan_cfg.MODEL.DEVICE=self.device
-        self.pan_cfg.merge_from_file(model_zoo.get_config_file("COCO-PanopticSegmentation/panoptic_fpn_R_101_3x.yaml"))
-        self.pan_cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-PanopticSegmentation/panoptic_fpn_R_101_3x.yaml")
-        self.pan_predictor = DefaultPredictor(self.pan_cfg)
+        self.pan_cfg, self.pan_predictor = get_predictor("panoptic", self.device)
 
 
-    def predict_keypoints(self, img):
+    def predict_keypoints(self, img, vis_path=None):
+        """
+        :param img:             BGR image
+        :param vis_path:        [opt] filename to save a drawing of the predictions, nothing is drawn if not given
+        :return:                keypoints dict of the first person or None
+        """
+        if self.kps_predictor is None:
+            self.setup_kps_predictor()
         outputs = self.kps_predictor(img)
-        v2 = Visualizer(img[:, :, ::-1], MetadataCatalog.get(self.kps_cfg.DATASETS.TRAIN[0]), scale=1)
-        v2 = v2.draw_instance_predictions(outputs["instances"].to("cpu"))
-        #cv2.imwrite(output_path, v2.get_image()[:,:,::-1])
-        persons = np.array(outputs["instances"].pred_keypoints.to("cpu"), dtype=float)
-        if len(persons) > 0:
-            return convert_keypoints_one_person(persons[0])
-        else:
-            return None
+        if vis_path is not None:
+            v2 = Visualizer(img[:, :, ::-1], MetadataCatalog.get(self.kps_cfg.DATASETS.TRAIN[0]), scale=1)
+            v2 = v2.draw_instance_predictions(outputs["instances"].to("cpu"))
+            cv2.imwrite(vis_path, v2.get_image()[:,:,::-1])
+        return keypoints_from_outputs(outputs)
+
+
+    def predict_keypoints_batch(self, imgs, rois=None, scale=1.0):
+        """
+        Predicts the keypoints of a list of images in one forward pass of the model
+        :param imgs:            list of BGR images
+        :param rois:            [opt] list with a region of interest (x1, y1, x2, y2) or None for every image, see predict_rois
+        :param scale:           [opt] inference scale relative to the input size of the model, see predict_rois
+        :return:                list with the keypoints dict (or None) for every image, in the coordinates of the full image
+        """
+        if self.kps_predictor is None:
+            self.setup_kps_predictor()
+        outputs, rois = predict_rois(self.kps_predictor, imgs, rois, scale)
+        results = []
+        for roi, out in zip(rois, outputs):
+            kps = keypoints_from_outputs(out)
+            results.append(kps if roi is None else shift_keypoints(kps, roi))
+        return results
 
 
-    def predict_mask_panoptic(self, img):
+    def predict_mask_panoptic(self, img, vis_path=None):
+        """
+        :param img:             BGR image
+        :param vis_path:        [opt] filename to save a drawing of the panoptic segmentation, nothing is drawn if not given
+        :return:                binary one channel mask (uint8, 0 or 255) of the persons in the image
+        """
+        if self.pan_predictor is None:
+            self.setup_pan_predictor()
         panoptic_seg, segments_info = self.pan_predictor(img)["panoptic_seg"]
-        v3 = Visualizer(img[:, :, ::-1], MetadataCatalog.get(self.pan_cfg.DATASETS.TRAIN[0]), scale=1)
-        v3 = v3.draw_panoptic_seg_predictions(panoptic_seg.to("cpu"), segments_info)
-        
-        ##create list of id's who are the person...
-        ids = [seg["id"] for seg in segments_info if seg["category_id"] == 0]
-        pan = np.array(panoptic_seg.to("cpu"))
-        mask = np.zeros(img.shape, dtype=int)
-        for c in range(3):
-            mask[:,:,c] = np.where(np.isin(pan, ids), 255.0, 0.0)
-        cv2.imwrite("temp.jpg", mask)
-        mask = cv2.imread("temp.jpg", cv2.IMREAD_GRAYSCALE)
-        os.remove("temp.jpg")
-        ret, mask = cv2.threshold(mask,127,255,cv2.THRESH_BINARY)
-        return mask
+        if vis_path is not None:
+            v3 = Visualizer(img[:, :, ::-1], MetadataCatalog.get(self.pan_cfg.DATASETS.TRAIN[0]), scale=1)
+            v3 = v3.draw_panoptic_seg_predictions(panoptic_seg.to("cpu"), segments_info)
+            cv2.imwrite(vis_path, v3.get_image()[:,:,::-1])
+        return mask_from_panoptic(panoptic_seg, segments_info)
+
+
+    def predict_mask_panoptic_batch(self, imgs, rois=None, scale=1.0):
+        """
+        Predicts the person masks of a list of images in one forward pass of the model
+        :param imgs:            list of BGR images
+        :param rois:            [opt] list with a region of interest (x1, y1, x2, y2) or None for every image, see predict_rois
+        :param scale:           [opt] inference scale relative to the input size of the model, see predict_rois
+        :return:                list with a binary one channel mask of the full image for every image
+        """
+        if self.pan_predictor is None:
+            self.setup_pan_predictor()
+        outputs, rois = predict_rois(self.pan_predictor, imgs, rois, scale)
+        masks = []
+        for img, roi, out in zip(imgs, rois, outputs):
+            panoptic_seg, segments_info = out["panoptic_seg"]
+            mask = mask_from_panoptic(panoptic_seg, segments_info)
+            masks.append(mask if roi is None else paste_mask(mask, roi, img.shape))
+        return masks
+
+
+def predict_batch(predictor, imgs, scales=None):
+    """
+    Runs the model of a DefaultPredictor on a list of images at once, with the same preprocessing as DefaultPredictor.__call__
+    :param predictor:       the DefaultPredictor
+    :param imgs:            list of BGR images
+    :param scales:          [opt] list with the resize factor of every image (None: resize like DefaultPredictor)
+    :return:                list with the outputs of the model for every image
+    """
+    aug = predictor.aug if hasattr(predictor, "aug") else predictor.transform_gen
+    with torch.no_grad():
+        inputs = []
+        for i in range(len(imgs)):
+            img = imgs[i]
+            if predictor.input_format == "RGB":
+                img = img[:, :, ::-1]
+            height, width = img.shape[:2]
+            if scales is None or scales[i] is None:
+                transform = aug.get_transform(img)
+            else:
+                transform = T.ResizeTransform(height, width, max(1, int(round(height * scales[i]))), max(1, int(round(width * scales[i]))))
+            image = transform.apply_image(img)
+            image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": image, "height": height, "width": width})
+        return predictor.model(inputs)
+
+
+def predict_rois(predictor, imgs, rois=None, scale=1.0):
+    """
+    Runs the model on the regions of interest of the images.
+    A crop is resized with the factor of its full image, so the person has the same size as in a full image prediction and the
+    model only processes the pixels of the crop. When no person is found in the crop with a score of at least ROI_MIN_SCORE,
+    or the person touches a side of the crop, the full image is predicted instead.
+    With a scale below 1 every image (or crop) is resized to that fraction of the input size of the model (ResizeShortestEdge).
+    The model maps its predictions back to the size of the image it was given (the height and width of the input),
+    so the keypoints are in the coordinates of the image and the masks are upsampled to the size of the image.
+    :param predictor:       the DefaultPredictor
+    :param imgs:            list of BGR images
+    :param rois:            [opt] list with a region of interest (x1, y1, x2, y2) or None for every image
+    :param scale:           [opt] inference scale relative to the input size of the model
+    :return:                outputs, rois: the outputs of the model and the region of interest of every output (None for a full image)
+    """
+    if rois is None:
+        return predict_batch(predictor, imgs, image_scales(predictor, imgs, scale)), [None] * len(imgs)
+    rois = list(rois)
+    crops = [img if roi is None else crop(img, roi) for img, roi in zip(imgs, rois)]
+    scales = image_scales(predictor, imgs, scale)
+    if scales is None:
+        scales = [None if roi is None else resize_scale(predictor.cfg, img.shape) for img, roi in zip(imgs, rois)]
+    outputs = predict_batch(predictor, crops, scales)
+
+    retry = [i for i in range(len(imgs)) if rois[i] is not None and not roi_confident(outputs[i]["instances"], rois[i], imgs[i].shape)]
+    if len(retry) > 0:
+        full = [imgs[i] for i in retry]
+        for i, out in zip(retry, predict_batch(predictor, full, image_scales(predictor, full, scale))):
+            outputs[i] = out
+            rois[i] = None
+    return outputs, rois
+
+
+def image_scales(predictor, imgs, scale=1.0):
+    """
+    :return:                list with the resize factor of every image at the inference scale, None for the default preprocessing
+    """
+    if scale == 1.0:
+        return None
+    return [resize_scale(predictor.cfg, img.shape) * scale for img in imgs]
+
+
+def resize_scale(cfg, shape):
+    """
+    :return:                the resize factor of an image with this shape in the preprocessing of DefaultPredictor (ResizeShortestEdge)
+    """
+    height, width = shape[:2]
+    scale = cfg.INPUT.MIN_SIZE_TEST / min(height, width)
+    if max(height, width) * scale > cfg.INPUT.MAX_SIZE_TEST:
+        scale = cfg.INPUT.MAX_SIZE_TEST / max(height, width)
+    return scale
+
+
+def roi_confident(instances, roi, shape):
+    """
+    :param instances:       the predicted instances of a crop
+    :param roi:             box (x1, y1, x2, y2) of the crop
+    :param shape:           shape of the full image
+    :return:                True if the best person in the crop has a high score and is not cut off by the crop
+    """
+    instances = instances[instances.pred_classes == 0]
+    if len(instances) == 0:
+        return False
+    best = int(instances.scores.argmax())
+    box = instances.pred_boxes.tensor[best].tolist()
+    return float(instances.scores[best]) >= ROI_MIN_SCORE and not touches_border(box, roi, shape)
+
+
+def keypoints_from_outputs(outputs):
+    persons = np.array(outputs["instances"].pred_keypoints.to("cpu"), dtype=float)
+    if len(persons) > 0:
+        return convert_keypoints_one_person(persons[0])
+    else:
+        return None
+
+
+def mask_from_panoptic(panoptic_seg, segments_info):
+    """
+    Converts the panoptic segment ids to a binary mask of the persons in memory
+    :param panoptic_seg:    tensor (H, W) with the segment id of every pixel
+    :param segments_info:   list of dicts with the id and category_id of every segment
+    :return:                one channel uint8 mask with value 255 for person pixels and 0 elsewhere
+    """
+    ##create list of id's who are the person...
+    ids = [seg["id"] for seg in segments_info if seg["category_id"] == 0]
+    pan = panoptic_seg.to("cpu").numpy()
+    return np.isin(pan, ids).astype(np.uint8) * 255
 
 
 
@@ -1,13 +1,14 @@
 import numpy as np
 import os
 
-from constants import KPS_GROUPS, KEYPOINTS
-from plot import plot_evaluation
+from constants import KPS_GROUPS, KEYPOINTS, EVALUATE_CHUNK_SIZE
+from plot import plot_evaluation, plot_curves
 from vis import *
-from get_data import get_keypoints, bounding_box_based_on_keypoints, calculate_distances
+from get_data import get_keypoints, bounding_box_based_on_keypoints
+from parallel import parallel_map
 
 
-def compare_libs_keypoints_distances(plot_folder, dataset_folder, threshold, img_set=None):
+def compare_libs_keypoints_distances(plot_folder, dataset_folder, threshold, img_set=None, workers=1, distances=None):
     """
     Compares the results of the libraries in the libs_folder and saves the comparison as a plot in the plot_folder map.
     For validation and evaluation the ground truth data is used. If the data consists of a certain set it can also be choosen.
@@ -15,20 +16,21 @@ def compare_libs_keypoints_distances(plot_folder, dataset_folder, threshold, img
     param plot_folder:          the folder where the results will be saved
     param dataset_folder:       the folder containing a subfolder with ground truth data and a folder with the output of different pose estimation libraries
     img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    workers:                    [opt] number of processes that read the keypoints of the libraries
+    distances:                  [opt] result of load_libs_distances, to avoid reading the keypoints again
     returns:                    no return value but the plots for accuracy and distance are saved to the plot_folder
     """
 
-    libs_folder = os.path.join(dataset_folder, "POSE_ESTIMATION")
-    ground_truth_folder = os.path.join(dataset_folder, "GROUND_TRUTH/POSE_ESTIMATION")
     accuracy = {}
     avg_distance = {}
-    for f in os.listdir(libs_folder):
-        if os.path.isdir(os.path.join(libs_folder,f)):
-            print(f)
-            test_data_folder = os.path.join(libs_folder, f)
-            acc, avg_dist = evaluate_keypoints_distances(ground_truth_folder, test_data_folder, threshold, img_set)
-            accuracy[f] = acc
-            avg_distance[f] = avg_dist 
+    if distances is None:
+        distances = load_libs_distances(dataset_folder, img_set, workers)
+    ground_kps, libs_distances = distances
+    for f in libs_distances:
+        print(f)
+        acc, avg_dist = keypoints_accuracy(libs_distances[f], ground_kps, threshold)
+        accuracy[f] = group_metrics(acc)
+        avg_distance[f] = group_metrics(avg_dist)
 
     labels = [group for group in KPS_GROUPS]
     if not os.path.exists(plot_folder):
@@ -47,7 +49,64 @@ def compare_libs_keypoints_distances(plot_folder, dataset_folder, threshold, img
     plot_evaluation(os.path.join(plot_folder, plot_name_dst), labels, avg_distance, "Average distance to ground truth point", vlines=[0.5,1.5])
 
 
-def evaluate_keypoints_distances(ground_truth_folder, data_folder, threshold, img_set):
+def compare_libs_pck_curves(plot_folder, dataset_folder, thresholds, img_set=None, workers=1, distances=None):
+    """
+    Compares the results of the libraries for a range of thresholds and saves the accuracy curves (PCK) as a plot in the plot_folder map.
+    The distances are calculated once per library, the accuracy for every threshold is derived from the sorted distances.
+
+    param plot_folder:          the folder where the results will be saved
+    param dataset_folder:       the folder containing a subfolder with ground truth data and a folder with the output of different pose estimation libraries
+    param thresholds:           list of thresholds for which the accuracy is calculated
+    img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    workers:                    [opt] number of processes that read the keypoints of the libraries
+    distances:                  [opt] result of load_libs_distances, to avoid reading the keypoints again
+    returns:                    no return value but the plot with a curve per library for every keypoint group is saved to the plot_folder
+    """
+    thresholds = np.asarray(thresholds)
+    curves = { group : {} for group in KPS_GROUPS }
+    if distances is None:
+        distances = load_libs_distances(dataset_folder, img_set, workers)
+    ground_kps, libs_distances = distances
+    for f in libs_distances:
+        print(f)
+        acc = group_metrics(pck_curve(libs_distances[f], ground_kps, thresholds))
+        for group in KPS_GROUPS:
+            curves[group][f] = acc[group]
+
+    if not os.path.exists(plot_folder):
+        os.mkdir(plot_folder)
+
+    title_set = ""
+    dataset_name = os.path.basename(os.path.dirname(dataset_folder))
+    plot_name = dataset_name + "_kps_pck.png"
+    if img_set is not None:
+        title_set = " (img set = "  + ", ".join(img_set) + ")"
+        plot_name = dataset_name + "_kps_pck_" + "".join(img_set) + ".png"
+
+    plot_curves(os.path.join(plot_folder, plot_name), thresholds, curves, "Accuracy keypoints per threshold" + title_set, factor=100, xlabel="threshold", ylabel="accuracy")
+
+
+def load_libs_distances(dataset_folder, img_set=None, workers=1):
+    """
+    Reads the ground truth and the keypoints of every library once and calculates their normalized distances to the ground truth,
+    the accuracy for one threshold and the accuracy curves are both derived from these distances.
+
+    param dataset_folder:       the folder containing a subfolder with ground truth data and a folder with the output of different pose estimation libraries
+    img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    workers:                    [opt] number of processes that read the keypoints of the libraries
+    returns:                    ground_kps, libs_distances: the ground truth keypoints array (see load_keypoints) and a dict of the library names
+                                mapped on their distances (see normalized_distances)
+    """
+    libs_folder = os.path.join(dataset_folder, "POSE_ESTIMATION")
+    ground_truth_folder = os.path.join(dataset_folder, "GROUND_TRUTH/POSE_ESTIMATION")
+    files, ground_kps, diagonals = load_ground_truth(ground_truth_folder, img_set)
+    libs = [f for f in sorted(os.listdir(libs_folder)) if os.path.isdir(os.path.join(libs_folder,f))]
+    libs_kps = load_libs_keypoints(libs_folder, libs, files, workers)
+    libs_distances = { f : normalized_distances(ground_kps, diagonals, libs_kps[f]) for f in libs }
+    return ground_kps, libs_distances
+
+
+def evaluate_keypoints_distances(ground_truth_folder, data_folder, threshold, img_set, ground_truth=None):
     """
     Evaluates the data of the library to be tested against the ground truth data.
     Accuracy and normalized average distance between the keypoints is calculated. For the normalization the diagonal of the bounding box is used.
@@ -55,28 +114,17 @@ def evaluate_keypoints_distances(ground_truth_folder, data_folder, threshold, im
     param ground_truth_folder:  the folder where the ground truth data can be find 
     param data_folder:          the folder with the result data of the library
     img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    ground_truth:               [opt] result of load_ground_truth, to avoid reading the ground truth again for every library
     returns:                    accuracy, avg_distance: two dicts of keypoints mapped on the value of the calculation
     """
-    accuracy = {}
-    avg_distance = {}
-
-    for group in KPS_GROUPS:
-        accuracy[group] = 0
-        avg_distance[group] = 0
-    
-    for kp in KEYPOINTS:
-        acc, avg_dist = evaluate_keypoint_distances(kp, ground_truth_folder, data_folder, threshold, img_set)
-        for group in KPS_GROUPS:
-            if kp in KPS_GROUPS[group]:
-                accuracy[group] += acc
-                avg_distance[group] += avg_dist
-
-    for group in KPS_GROUPS:
-        accuracy[group] /= len(KPS_GROUPS[group])
-        avg_distance[group] /= len(KPS_GROUPS[group])
-
-    return accuracy, avg_distance
+    if ground_truth is None:
+        ground_truth = load_ground_truth(ground_truth_folder, img_set)
+    files, ground_kps, diagonals = ground_truth
+    data_kps = load_keypoints(data_folder, files)
 
+    distances = normalized_distances(ground_kps, diagonals, data_kps)
+    acc, avg_dist = keypoints_accuracy(distances, ground_kps, threshold)
+    return group_metrics(acc), group_metrics(avg_dist)
 
 
 def evaluate_keypoint_distances(keypoint, ground_truth_folder, data_folder, threshold, img_set):
@@ -92,51 +140,160 @@ def evaluate_keypoint_distances(keypoint, ground_truth_folder, data_folder, thre
     threshold:                  [opt, default: 5] value that is used to decide if a keypoint is estimated correctly when the distance is lower than this threshold
     returns:                    acc, avg_dist: the accuracy of the correct estimated keypoints and the average distance
     """
-    ground_list = []
-    data_list = []
-    diagonal_bounding_box = []
-    files = sorted(os.listdir(ground_truth_folder))
+    files, ground_kps, diagonals = load_ground_truth(ground_truth_folder, img_set)
+    data_kps = load_keypoints(data_folder, files)
+    distances = normalized_distances(ground_kps, diagonals, data_kps)
+    acc, avg_dist = keypoints_accuracy(distances, ground_kps, threshold)
+    k = KEYPOINTS.index(keypoint)
+    return acc[k], avg_dist[k]
+
+
+def load_keypoints(data_folder, files):
+    """
+    Reads the keypoints of all files into one array, a keypoint that is not predicted gets the value [0, 0, 0].
+
+    param data_folder:          the folder with the json files
+    param files:                list of filenames to read
+    returns:                    array (files x KEYPOINTS x 3) with [x, y, c] for every keypoint, c is 1 when the data has no certainty
+    """
+    kps_array = np.zeros((len(files), len(KEYPOINTS), 3))
+    for i in range(len(files)):
+        fill_keypoints(kps_array[i], get_keypoints(os.path.join(data_folder, files[i])))
+    return kps_array
+
+
+def load_libs_keypoints(libs_folder, libs, files, workers=1, chunk_size=EVALUATE_CHUNK_SIZE):
+    """
+    Reads the keypoints of several libraries, every (library, chunk of files) is a job for a pool of worker processes.
+    The chunks are joined in the order of the files, so the arrays are identical to load_keypoints.
+
+    param libs_folder:          the folder with a subfolder for every library
+    param libs:                 list of library names
+    param files:                list of filenames to read
+    param workers:              [opt] number of processes
+    param chunk_size:           [opt] number of files that are read in one job
+    returns:                    dict of the library names mapped on the keypoints array (see load_keypoints)
+    """
+    jobs = []
+    for lib in libs:
+        for i in range(0, len(files), chunk_size):
+            jobs.append((load_keypoints, os.path.join(libs_folder, lib), files[i:i+chunk_size]))
+    chunks = parallel_map(jobs, workers)
+
+    libs_kps = {}
+    n_chunks = len(range(0, len(files), chunk_size))
+    for l in range(len(libs)):
+        parts = chunks[l*n_chunks:(l+1)*n_chunks]
+        libs_kps[libs[l]] = np.concatenate(parts) if len(parts) > 0 else np.zeros((0, len(KEYPOINTS), 3))
+    return libs_kps
+
+
+def fill_keypoints(kps_row, kps):
+    """
+    Fills one row of a keypoints array with the keypoints of a dict
+    param kps_row:              array (KEYPOINTS x 3) to fill
+    param kps:                  dict with name of keypoint mapped on the [x, y] or [x, y, c] point, or None
+    """
+    if kps is None:
+        return
+    for k in range(len(KEYPOINTS)):
+        if KEYPOINTS[k] in kps:
+            kp = kps[KEYPOINTS[k]]
+            kps_row[k] = [kp[0], kp[1], kp[2] if len(kp) > 2 else 1]
+
+
+def load_ground_truth(ground_truth_folder, img_set=None):
+    """
+    Reads the ground truth keypoints once and calculates the diagonal of the bounding box for every file.
 
+    param ground_truth_folder:  the folder where the ground truth data can be find 
+    img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    returns:                    files, ground_kps, diagonals: the list of filenames, the keypoints array (see load_keypoints) and an array with the diagonals
+    """
+    files = sorted(os.listdir(ground_truth_folder))
     if img_set is not None:
         files = [f for f in files if any(ext in f for ext in img_set)]
 
-    ground_truth_n = 0 
-    # Counter for the number of keypoints that are expected to be predicted
-
-    for f in files:
-        json_ground = os.path.join(ground_truth_folder, f)
-        json_data = os.path.join(data_folder, f)
-        ground_kps = get_keypoints(json_ground)
-        data_kps = get_keypoints(json_data)
-        
-        if ground_kps[keypoint][:2] == [0, 0]:   
-            # The keypoint is not visible in the picture according to ground truth
-            continue
-        ground_truth_n += 1
-        if data_kps is None or keypoint not in data_kps or data_kps[keypoint][:2] == [0, 0]:     
-            # The keypoint is not predicted in the picture by the pose estimation algorithm
-            continue
-        
-        ground_list.append(ground_kps[keypoint])
-        data_list.append(data_kps[keypoint])
-        
-        b, w, h, diagonal, a = bounding_box_based_on_keypoints(ground_kps)
-        diagonal_bounding_box.append(diagonal)
-
-
-    distances = calculate_distances(ground_list, data_list)
-    normalized_distances = np.divide(distances,diagonal_bounding_box)
-    distances = 100 * normalized_distances
-
-    if len(distances) == 0:
-        return 0, -1
-
-    avg_dist = sum(distances) / len(distances)
-    
-    correct = 0
-    total = len(ground_list)
-    correct = sum([1 for d in distances if d < threshold])
-    
-    acc = correct/ground_truth_n
-    
-    return acc, avg_dist
\ No newline at end of file
+    ground_kps = np.zeros((len(files), len(KEYPOINTS), 3))
+    diagonals = np.zeros(len(files))
+    for i in range(len(files)):
+        kps = get_keypoints(os.path.join(ground_truth_folder, files[i]))
+        fill_keypoints(ground_kps[i], kps)
+        b, w, h, diagonal, a = bounding_box_based_on_keypoints(kps)
+        diagonals[i] = diagonal
+    return files, ground_kps, diagonals
+
+
+def visible_keypoints(kps_array):
+    """
+    param kps_array:            keypoints array (see load_keypoints)
+    returns:                    boolean array (files x KEYPOINTS), False where the keypoint is [0, 0]
+    """
+    return (kps_array[:,:,0] != 0) | (kps_array[:,:,1] != 0)
+
+
+def normalized_distances(ground_kps, diagonals, data_kps):
+    """
+    Calculates the distances between the ground truth and predicted keypoints for all files and keypoints at once.
+    The distances are normalized by the diagonal of the bounding box of the ground truth and multiplied by 100.
+
+    param ground_kps:           ground truth keypoints array (see load_keypoints)
+    param diagonals:            diagonals of the ground truth bounding boxes
+    param data_kps:             keypoints array of the library
+    returns:                    array (files x KEYPOINTS) with the distances, NaN where the keypoint is not visible or not predicted
+    """
+    valid = visible_keypoints(ground_kps) & visible_keypoints(data_kps)
+    distances = np.linalg.norm(ground_kps[:,:,:2] - data_kps[:,:,:2], axis=2)
+    distances = 100 * distances / diagonals[:,None]
+    return np.where(valid, distances, np.nan)
+
+
+def keypoints_accuracy(distances, ground_kps, threshold):
+    """
+    Calculates the accuracy and the average distance of every keypoint.
+    A keypoint is estimated correctly when the distance is lower than the threshold, keypoints that are not visible in the ground truth are not counted.
+
+    param distances:            normalized distances (see normalized_distances)
+    param ground_kps:           ground truth keypoints array (see load_keypoints)
+    param threshold:            value that is used to decide if a keypoint is estimated correctly
+    returns:                    acc, avg_dist: arrays with a value for every keypoint, avg_dist is -1 and acc 0 when no keypoint was predicted
+    """
+    ground_truth_n = np.count_nonzero(visible_keypoints(ground_kps), axis=0)
+    predicted = ~np.isnan(distances)
+    predicted_n = np.count_nonzero(predicted, axis=0)
+    correct = np.count_nonzero(distances < threshold, axis=0)
+
+    has_data = predicted_n > 0
+    acc = np.where(has_data, correct / np.maximum(ground_truth_n, 1), 0)
+    avg_dist = np.where(has_data, np.nansum(distances, axis=0) / np.maximum(predicted_n, 1), -1)
+    return acc, avg_dist
+
+
+def pck_curve(distances, ground_kps, thresholds):
+    """
+    Calculates the accuracy of every keypoint for a range of thresholds in one pass.
+    The distances of each keypoint are sorted once, the number of correct keypoints for a threshold is the position of that threshold in the sorted distances.
+
+    param distances:            normalized distances (see normalized_distances)
+    param ground_kps:           ground truth keypoints array (see load_keypoints)
+    param thresholds:           array of thresholds
+    returns:                    array (KEYPOINTS x thresholds) with the accuracy, equal to keypoints_accuracy for each threshold
+    """
+    ground_truth_n = np.count_nonzero(visible_keypoints(ground_kps), axis=0)
+    # NaN values are sorted to the end and are never lower than a threshold
+    sorted_distances = np.sort(distances, axis=0)
+    acc = np.zeros((len(KEYPOINTS), len(thresholds)))
+    for k in range(len(KEYPOINTS)):
+        correct = np.searchsorted(sorted_distances[:,k], thresholds, side="left")
+        acc[k] = correct / max(ground_truth_n[k], 1)
+    return acc
+
+
+def group_metrics(values):
+    """
+    Averages the values of the keypoints for every group in KPS_GROUPS
+
+    param values:               array with a value (or a row of values) for every keypoint in KEYPOINTS
+    returns:                    dict of the groups mapped on the average value (a float, or a list for rows of values)
+    """
+    return { group : np.mean([values[KEYPOINTS.index(kp)] for kp in KPS_GROUPS[group]], axis=0).tolist() for group in KPS_GROUPS }
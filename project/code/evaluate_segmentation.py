@@ -4,10 +4,11 @@ import numpy as np
 
 from plot import plot_evaluation
 from get_data import get_mask
-from constants import MASK_BOX_EXPAND
+from constants import MASK_BOX_EXPAND, MASK_BATCH_SIZE, EVALUATE_CHUNK_SIZE
+from parallel import parallel_map
 
 
-def compare_libs_masks(plot_folder, dataset_folder, img_set=None):
+def compare_libs_masks(plot_folder, dataset_folder, img_set=None, workers=1):
     """
     Compares the results of the libraries in the libs_folder and saves the comparison as a plot in the plot_folder map.
     For validation and evaluation the ground truth data is used. If the data consists of a certain set it can also be choosen.
@@ -15,18 +16,30 @@ def compare_libs_masks(plot_folder, dataset_folder, img_set=None):
     param plot_folder:          the folder where the results will be saved
     param dataset_folder:       the folder containing a subfolder with ground truth data and a folder with the output of different person segmentation libraries
     img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    workers:                    [opt] number of processes, every (library, chunk of images) is a separate job
     returns:                    no return value but the plots for accuracy and distance are saved to the plot_folder
     """
 
     libs_folder = os.path.join(dataset_folder, "SEGMENTATION")
     ground_truth_folder = os.path.join(dataset_folder, "GROUND_TRUTH/SEGMENTATION")
     metrics = {}
-    for f in sorted(os.listdir(libs_folder))[:]:
-        if os.path.isdir(os.path.join(libs_folder,f)):
-            print(f)
-            test_data_folder = os.path.join(libs_folder, f)
-            met = evaluate_masks(ground_truth_folder, test_data_folder, img_set)
-            metrics[f] = met
+    libs = [f for f in sorted(os.listdir(libs_folder))[:] if os.path.isdir(os.path.join(libs_folder,f))]
+    jobs = []
+    for f in libs:
+        test_data_folder = os.path.join(libs_folder, f)
+        files = mask_files(test_data_folder, img_set)
+        for i in range(0, len(files), EVALUATE_CHUNK_SIZE):
+            jobs.append((f, len(files), (evaluate_mask_files, ground_truth_folder, test_data_folder, files[i:i+EVALUATE_CHUNK_SIZE])))
+
+    # the metrics of the chunks are reduced in the order of the files, like evaluate_masks does
+    mets = {f : [] for f in libs}
+    n_files = {f : 0 for f in libs}
+    for (f, n, job), chunk in zip(jobs, parallel_map([job for f, n, job in jobs], workers)):
+        mets[f] += chunk
+        n_files[f] = n
+    for f in libs:
+        print(f)
+        metrics[f] = reduce_mask_metrics(mets[f], n_files[f])
     if len(metrics.keys()) > 0:
         metric_names = list(metrics[list(metrics.keys())[0]])
         #print(metric_names)
@@ -40,27 +53,69 @@ def compare_libs_masks(plot_folder, dataset_folder, img_set=None):
         plot_evaluation(os.path.join(plot_folder, plot_name), metric_names, metrics, "Segmentation evaluation " + title_set, factor=100)
 
 
-def evaluate_masks(ground_truth_folder, data_folder, img_set=None):
+def evaluate_masks(ground_truth_folder, data_folder, img_set=None, batch_size=MASK_BATCH_SIZE):
     """
     Evaluates the data of the library to be tested against the ground truth data.
     ACC, TPR, FPR, FNR, PPV and the predicted area of the mask is calculated. 
     For normalization a wider bounding box of the ground truth mask is used.
+    The masks are loaded and evaluated in batches of batch_size masks.
 
     param ground_truth_folder:  the folder where the ground truth data can be find 
     param data_folder:          the folder with the result data of the library
     img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    batch_size:                 [opt] number of masks that are evaluated at once
     returns:                    a map of calculated metrics for the library
     """
-    metrics = {}
+    files = mask_files(data_folder, img_set)
+    return reduce_mask_metrics(evaluate_mask_files(ground_truth_folder, data_folder, files, batch_size), len(files))
+
+
+def mask_files(data_folder, img_set=None):
+    """
+    param data_folder:          the folder with the result data of the library
+    img_set:                    [opt] list of filenames that can be provided to evaluate a certain set of images
+    returns:                    sorted list of the filenames of the masks to evaluate
+    """
     files = sorted(os.listdir(data_folder))[:]
     if img_set is not None:
         files = [f for f in files if any(ext in f for ext in img_set)]
+    return files
+
+
+def evaluate_mask_files(ground_truth_folder, data_folder, files, batch_size=MASK_BATCH_SIZE):
+    """
+    Calculates the metrics of a list of masks, the masks are loaded and evaluated in batches of batch_size masks.
 
-    for f in files:
-        gt_mask_path = os.path.join(ground_truth_folder, f)
-        data_mask_path = os.path.join(data_folder, f)    
-        print(gt_mask_path, data_mask_path)
-        met = evaluate_mask(gt_mask_path, data_mask_path)
+    param ground_truth_folder:  the folder where the ground truth data can be find 
+    param data_folder:          the folder with the result data of the library
+    param files:                list of filenames of the masks
+    batch_size:                 [opt] number of masks that are evaluated at once
+    returns:                    list of metric dictionaries (see metrics_from_counts) in the order of files
+    """
+    mets = []
+    for i in range(0, len(files), batch_size):
+        gt_masks = []
+        data_masks = []
+        for f in files[i:i+batch_size]:
+            gt_mask_path = os.path.join(ground_truth_folder, f)
+            data_mask_path = os.path.join(data_folder, f)    
+            print(gt_mask_path, data_mask_path)
+            gt_masks.append(get_mask(gt_mask_path))
+            data_masks.append(get_mask(data_mask_path))
+        mets += evaluate_mask_batch(gt_masks, data_masks)
+    return mets
+
+
+def reduce_mask_metrics(mets, n_files):
+    """
+    Averages the metrics of the masks, metrics with the value -1 are not counted in the sum
+
+    param mets:                 list of metric dictionaries
+    param n_files:              number of evaluated files
+    returns:                    a map of the average metrics
+    """
+    metrics = {}
+    for met in mets:
         for m in met:
             if met[m] != -1:
                 if m in metrics:
@@ -68,10 +123,11 @@ def evaluate_masks(ground_truth_folder, data_folder, img_set=None):
                 else:
                     metrics[m] = met[m]
     for m in metrics:
-        metrics[m] /= len(files)
+        metrics[m] /= n_files
 
     return metrics
 
+
 def evaluate_mask(gt_mask_path, data_mask_path):
     """
     Calculates the metrics of one mask against the corresponding ground truth mask
@@ -81,46 +137,80 @@ def evaluate_mask(gt_mask_path, data_mask_path):
     returns:                    calculated metrics in a dictionary: ACC, TPR, TNR, FPR, FNR, PPV, AREA_COMP_BOX, AREA_COMP_FULL
     """
     gt_mask = get_mask(gt_mask_path)
-    points = cv2.findNonZero(gt_mask)
-    box = cv2.boundingRect(points)
-    r_x, r_y, r_w, r_h = box
     data_mask = get_mask(data_mask_path)
-    x1 = r_x
-    x2 = r_x + r_w
-    y1 = r_y
-    y2 = r_y + r_h
+    return evaluate_mask_batch([gt_mask], [data_mask])[0]
+
+
+def evaluate_mask_batch(gt_masks, data_masks):
+    """
+    Calculates the metrics of a list of masks against the corresponding ground truth masks.
+    Every mask is counted inside its own cropped box (see confusion_counts), the masks are not copied into a stack.
+
+    param gt_masks:             list of ground truth masks (black and white one channel images)
+    param data_masks:           list of predicted masks corresponding to gt_masks
+    returns:                    list of metric dictionaries (see metrics_from_counts) in the order of the input
+    """
+    return [metrics_from_counts(*confusion_counts(gt_mask, data_mask)) for gt_mask, data_mask in zip(gt_masks, data_masks)]
+
+
+def expanded_box(gt_mask):
+    """
+    Calculates the bounding box of a ground truth mask, expanded with MASK_BOX_EXPAND.
+    The bounding box is expanded to include more interesting pixels around te border of the segmentation of the cyclist.
+
+    param gt_mask:              ground truth mask (H, W)
+    returns:                    x1, y1, x2, y2: the corners of the expanded box
+    """
+    h, w = gt_mask.shape
+    rows = gt_mask.any(axis=1)
+    cols = gt_mask.any(axis=0)
+    r_y = int(np.argmax(rows))
+    r_x = int(np.argmax(cols))
+    r_h = h - int(np.argmax(rows[::-1])) - r_y
+    r_w = w - int(np.argmax(cols[::-1])) - r_x
 
-    ## The bouding box is expanded to include more interesting pixels around te border of the segmentation of the cyclist
-    ## Using the constant MASK_BOX_EXPAND (can be changed in the constants files)
     e = MASK_BOX_EXPAND
     x1 = max(r_x - int(e*r_w), 0)
     y1 = max(r_y - int(e*r_h), 0)
-    x2 = min(r_x + int((1+e)*r_w), gt_mask.shape[1])
-    y2 = min(r_y + int((1+e)*r_h), gt_mask.shape[0])
-    r_h = y2-y1
-    r_w = x2-x1
-    ##
-
-    gt_box = gt_mask[y1:y2, x1:x2]      
-    data_box = data_mask[y1:y2, x1:x2]      
-    total = r_h * r_w
-
-    p, n, tp, tn, fp, fn = 0, 0, 0, 0, 0, 0   
-    for gt_r, data_r in zip(gt_box, data_box):
-        for gt, data in zip(gt_r, data_r):
-            if gt == 255:
-                p += 1
-            elif gt == 0:
-                n += 1
-            if gt == 255 and data == 255:
-                tp += 1       
-            elif gt == 0 and data == 0:
-                tn += 1
-            elif gt == 0 and data == 255:
-                fp += 1
-            elif gt == 255 and data == 0:
-                fn += 1
+    x2 = min(r_x + int((1+e)*r_w), w)
+    y2 = min(r_y + int((1+e)*r_h), h)
+    return x1, y1, x2, y2
+
 
+def confusion_counts(gt_mask, data_mask):
+    """
+    Counts the positives, negatives and confusion matrix of a mask inside the expanded ground truth box.
+    Only the cropped box is compared, so no temporary arrays of the size of the full mask are made for the confusion matrix.
+
+    param gt_mask:              ground truth mask with values 0 and 255
+    param data_mask:            predicted mask with values 0 and 255
+    returns:                    p, n, tp, tn, fp, fn, data_area, gt_area
+    """
+    x1, y1, x2, y2 = expanded_box(gt_mask)
+    gt = gt_mask[y1:y2, x1:x2] == 255
+    data = data_mask[y1:y2, x1:x2] == 255
+    p = int(np.count_nonzero(gt))
+    tp = int(np.count_nonzero(gt & data))
+    fp = int(np.count_nonzero(data)) - tp
+    fn = p - tp
+    n = (y2 - y1) * (x2 - x1) - p
+    tn = n - fp
+    data_area = int(np.count_nonzero(data_mask == 255))
+    gt_area = int(np.count_nonzero(gt_mask == 255))
+    return p, n, tp, tn, fp, fn, data_area, gt_area
+
+
+def metrics_from_counts(p, n, tp, tn, fp, fn, data_area, gt_area):
+    """
+    Calculates the metrics of one mask based on the counts of the confusion matrix
+
+    param p, n:                 number of positive and negative ground truth pixels in the box
+    param tp, tn, fp, fn:       number of true positive, true negative, false positive and false negative pixels in the box
+    param data_area:            number of positive pixels in the full predicted mask
+    param gt_area:              number of positive pixels in the full ground truth mask
+    returns:                    calculated metrics in a dictionary: ACC, TPR, TNR, FPR, FNR, PPV, AREA_COMP_BOX, AREA_COMP_FULL
+    """
+    total = p + n
     tpr = tp / p
     tnr = tn / n
     fpr = 1 - tpr
@@ -132,7 +222,7 @@ def evaluate_mask(gt_mask_path, data_mask_path):
     acc = (tp + tn) / total
 
     area_comp_box  = (tp + fp) / p
-    area_comp_full = sum(map(sum, data_mask)) / sum(map(sum, gt_mask))
+    area_comp_full = data_area / gt_area
     
     return {    "ACC"                   :   acc, 
                 "TPR"                   :   tpr, 
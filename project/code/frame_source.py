@@ -0,0 +1,178 @@
+import os
+import cv2
+import numpy as np
+
+from constants import VIDEO_GOP_SIZE, SAMPLING_DIFF_WIDTH, SAMPLING_MOTION_THRESHOLD, SAMPLING_MAX_INTERVAL
+
+
+IMG_TYPES = [".jpg", ".png", ".jpeg"]
+VID_TYPES = [".mp4", ".mov"]
+
+
+class FrameSource:
+    """
+    Reads the frames of an image or a video in order, every skip_frames frames.
+    skip_frames can also be a list, then the union of the frames of every stride is read (e.g. for several analyse rates).
+    Frames in between are skipped with grab() which does not retrieve (convert) the frame,
+    only when the stride is larger than the GOP size the decoder seeks to the next frame.
+    """
+    file_path                   =   None
+    video_cap                   =   None
+    skip_frames                 =   None
+    gop_size                    =   None
+    fps                         =   None
+    position                    =   None
+    next_frame                  =   None
+
+    def __init__(self, file_path, skip_frames=1, gop_size=VIDEO_GOP_SIZE):
+        super().__init__()
+        self.file_path = file_path
+        self.set_skip_frames(skip_frames)
+        self.gop_size = gop_size
+        self.fps = 0
+        self.position = 0
+        self.next_frame = 0
+        self.video_cap = None
+        if is_video(file_path):
+            self.video_cap = cv2.VideoCapture(file_path)
+            self.fps = self.video_cap.get(cv2.CAP_PROP_FPS)
+
+    def set_skip_frames(self, skip_frames):
+        if isinstance(skip_frames, (list, tuple)):
+            self.skip_frames = sorted(set(max(1, int(s)) for s in skip_frames))
+        else:
+            self.skip_frames = max(1, int(skip_frames))
+
+    def next_sample(self, frame_number):
+        """
+        :param frame_number:    the index of the last read frame
+        :return:                the index of the next frame that is a multiple of (one of) the skip frames
+        """
+        if isinstance(self.skip_frames, list):
+            return min((frame_number // s + 1) * s for s in self.skip_frames)
+        return frame_number + self.skip_frames
+
+    def read(self):
+        """
+        Reads the next frame of the source
+        :return:                frame, frame_number, timestamp (seconds) or None, None, None when there are no frames left
+        """
+        if self.video_cap is None:
+            frame = None
+            if self.next_frame == 0:
+                frame = cv2.imread(self.file_path)
+            self.next_frame = self.next_sample(self.next_frame)
+            if frame is None:
+                return None, None, None
+            return frame, 0, 0.0
+
+        if not self.move_to(self.next_frame):
+            return None, None, None
+        frame_number = self.position
+        ret, frame = self.video_cap.read()
+        if not ret:
+            return None, None, None
+        self.position += 1
+        self.next_frame = self.next_sample(frame_number)
+        return frame, frame_number, self.timestamp(frame_number)
+
+    def move_to(self, frame_number):
+        """
+        Moves the video to frame_number, by grabbing the frames in between or by seeking if the distance is larger than the GOP size
+        :param frame_number:    the index of the frame that is read next
+        :return:                False if the end of the video is reached
+        """
+        distance = frame_number - self.position
+        if distance < 0 or distance > self.gop_size:
+            self.video_cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            self.position = int(self.video_cap.get(cv2.CAP_PROP_POS_FRAMES))
+            return True
+        for i in range(distance):
+            if not self.video_cap.grab():
+                return False
+            self.position += 1
+        return True
+
+    def timestamp(self, frame_number):
+        if self.fps > 0:
+            return frame_number / self.fps
+        return 0.0
+
+    def release(self):
+        if self.video_cap is not None:
+            self.video_cap.release()
+
+
+class MotionSampler:
+    """
+    Selects the frames of a FrameSource that are analysed based on the motion in the video.
+    Every frame is compared with the last selected frame on a downscaled gray image, a frame is selected when the mean
+    absolute difference is larger than the motion threshold or when the last selected frame is older than max_interval.
+    The number of selected frames is limited by a budget of frames per second of video (a token bucket with a burst of one second),
+    so the frames are analysed densely when there is a lot of motion and sparsely when there is not.
+    """
+    frame_source                =   None
+    budget                      =   None
+    motion_threshold            =   None
+    max_interval                =   None
+    width                       =   None
+    frames_read                 =   None
+    frames_selected             =   None
+
+    def __init__(self, frame_source, budget, motion_threshold=SAMPLING_MOTION_THRESHOLD, max_interval=SAMPLING_MAX_INTERVAL, width=SAMPLING_DIFF_WIDTH):
+        super().__init__()
+        self.frame_source = frame_source
+        self.budget = float(budget)
+        self.motion_threshold = motion_threshold
+        self.max_interval = max_interval
+        self.width = width
+        self.frames_read = 0
+        self.frames_selected = 0
+        self.tokens = 0.0
+        self.last = None
+        self.last_timestamp = None
+        self.previous_timestamp = None
+
+    def downscale(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        height = max(1, int(round(gray.shape[0] * self.width / gray.shape[1])))
+        return cv2.resize(gray, (self.width, height), interpolation=cv2.INTER_AREA)
+
+    def read(self):
+        """
+        Reads frames of the source until a frame is selected
+        :return:                frame, frame_number, timestamp (seconds) of the selected frame or None, None, None at the end of the source
+        """
+        while True:
+            frame, frame_number, timestamp = self.frame_source.read()
+            if frame is None:
+                return None, None, None
+            self.frames_read += 1
+            small = self.downscale(frame)
+
+            select = self.last is None
+            if not select:
+                self.tokens = min(max(1.0, self.budget), self.tokens + (timestamp - self.previous_timestamp) * self.budget)
+                if self.tokens >= 1:
+                    motion = float(np.mean(cv2.absdiff(small, self.last)))
+                    select = motion >= self.motion_threshold or timestamp - self.last_timestamp >= self.max_interval
+            self.previous_timestamp = timestamp
+
+            if select:
+                if self.last is not None:
+                    self.tokens -= 1
+                self.last = small
+                self.last_timestamp = timestamp
+                self.frames_selected += 1
+                return frame, frame_number, timestamp
+
+    def release(self):
+        self.frame_source.release()
+
+
+def is_video(file_path):
+    return os.path.splitext(file_path)[1] in VID_TYPES
+
+
+def is_image(file_path):
+    return os.path.splitext(file_path)[1] in IMG_TYPES
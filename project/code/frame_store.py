@@ -0,0 +1,112 @@
+import json
+import numpy as np
+
+from constants import KEYPOINTS, KPS_ANGLES, FRAME_STORE_CAPACITY
+
+
+def frame_store_dtype():
+    """
+    :return:                structured dtype with a column for the frame number, the timestamp, the x, y and c of every keypoint,
+                            every angle of KPS_ANGLES, the area and the area of interest
+    """
+    columns = [("frame", np.int64), ("timestamp", np.float64)]
+    for kp in KEYPOINTS:
+        columns += [(kp + "_x", np.float64), (kp + "_y", np.float64), (kp + "_c", np.float64)]
+    columns += [(angle, np.float64) for angle in KPS_ANGLES]
+    columns += [("area", np.float64), ("area_interest", np.float64)]
+    return np.dtype(columns)
+
+
+def empty_rows(n_rows):
+    """
+    :return:                structured array with n_rows rows, the frame numbers are 0 and all other values NaN
+    """
+    rows = np.zeros(n_rows, dtype=frame_store_dtype())
+    for name in rows.dtype.names:
+        if name != "frame":
+            rows[name] = np.nan
+    return rows
+
+
+class FrameStore:
+    """
+    Columnar store of the results of the analysed frames of one file (see CycloDetector.analyse_frame).
+    The rows are kept in a preallocated structured array that doubles its capacity when it is full, missing values are NaN.
+    A store is saved as a .npy file that can be memory-mapped and a .json file with the metadata of the analysis,
+    so the results can be plotted or analysed again without the video or the detectron2 cache.
+    """
+    data                        =   None
+    size                        =   None
+    meta                        =   None
+
+    def __init__(self, capacity=FRAME_STORE_CAPACITY, meta=None):
+        super().__init__()
+        self.data = empty_rows(max(1, capacity))
+        self.size = 0
+        self.meta = {} if meta is None else meta
+
+    def __len__(self):
+        return self.size
+
+    def append(self, res):
+        """
+        :param res:             the result of a frame with frame, timestamp, keypoints, angles and (optionally) area and area_interest
+        """
+        if self.size == len(self.data):
+            data = empty_rows(2 * len(self.data))
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        row = self.data[self.size:self.size+1]
+        row["frame"] = res["frame"]
+        row["timestamp"] = res["timestamp"]
+        kps = res["keypoints"]
+        if kps is not None:
+            for kp in KEYPOINTS:
+                if kp in kps:
+                    row[kp + "_x"] = kps[kp][0]
+                    row[kp + "_y"] = kps[kp][1]
+                    row[kp + "_c"] = kps[kp][2] if len(kps[kp]) > 2 else 1
+        for angle in res["angles"]:
+            row[angle] = res["angles"][angle]
+        if "area" in res:
+            row["area"] = res["area"]
+            row["area_interest"] = res["area_interest"]
+        self.size += 1
+
+    def rows(self):
+        """
+        :return:                structured array with the stored rows (a view, not a copy)
+        """
+        return self.data[:self.size]
+
+    def points(self, kp, rows=None):
+        """
+        :param kp:              name of the keypoint
+        :param rows:            [opt] subset of the rows, all rows by default
+        :return:                array (frames x 2) with the x and y of the keypoint
+        """
+        if rows is None:
+            rows = self.rows()
+        return np.stack([rows[kp + "_x"], rows[kp + "_y"]], axis=1)
+
+    def save(self, path):
+        """
+        Saves the rows to <path>.npy and the metadata to <path>.json
+        """
+        np.save(path + ".npy", self.rows())
+        with open(path + ".json", "w") as f:
+            json.dump(self.meta, f, indent=1)
+
+
+def load_frame_store(path, mmap=True):
+    """
+    :param path:            path of the store without extension (see FrameStore.save)
+    :param mmap:            [opt] memory-map the rows instead of reading them
+    :return:                FrameStore object (read only when it is memory-mapped)
+    """
+    store = FrameStore(capacity=1)
+    store.data = np.load(path + ".npy", mmap_mode="r" if mmap else None)
+    store.size = len(store.data)
+    with open(path + ".json") as f:
+        store.meta = json.load(f)
+    return store
@@ -124,7 +124,7 @@ def get_area(mask):
     :param mask:            a black and white image representing a segmentation mask
     :return:                the number of pixels or area of the segmentation in the mask
     """
-    return int(sum(map(sum, mask)) / 255)
+    return cv2.countNonZero(mask)
 
 
 def get_angle(angle, kps):
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+from contextlib import contextmanager
+
+from config import DETECTRON_PATH, DETECTRON_DEVICE, DETECTRON_CACHE_MAX_SIZE, DETECTRON_CACHE_GRACE, PREDICTOR_CONFIGS
+
+
+## file extension and predictor of every kind of cached detectron2 output
+CACHE_KINDS = {
+    "pose_estimation"   :   (".kps", "keypoints"),
+    "segmentation"      :   (".masks", "panoptic"),
+}
+## changes when the content of the cache files changes, so old entries are not reused
+CACHE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def model_identity(kind, device=DETECTRON_DEVICE, options=None):
+    """
+    :param kind:            key in CACHE_KINDS
+    :param device:          [opt] the device used for inference (cpu or cuda)
+    :param options:         [opt] dict with the inference options that change the predictions (e.g. the region of interest mode)
+    :return:                dict with everything that changes the predictions of a kind of cache
+    """
+    config_file, score_threshold = PREDICTOR_CONFIGS[CACHE_KINDS[kind][1]]
+    identity = {
+        "kind"              :   kind,
+        "config"            :   config_file,
+        "score_threshold"   :   score_threshold,
+        "device"            :   device,
+        "version"           :   CACHE_FORMAT_VERSION,
+    }
+    if options:
+        identity["options"] = options
+    return identity
+
+
+def model_hash(kind, device=DETECTRON_DEVICE, options=None):
+    identity = json.dumps(model_identity(kind, device, options), sort_keys=True)
+    return hashlib.sha1(identity.encode()).hexdigest()[:12]
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """
+    :param file_path:       path of the video or image
+    :param chunk_size:      [opt] number of bytes that are read at once
+    :return:                sha1 hex digest of the content of the file
+    """
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class InferenceCache:
+    """
+    Cache of the detectron2 output, keyed by a hash of the content of the video and a hash of the model identity
+    (config, score threshold, device), so files with the same name never collide and a changed model is never reused.
+    The manifest (manifest.json) keeps the source, size and last use of every entry and the hashes of the known videos.
+    When the cache is larger than max_size the least recently used entries are removed, except the entries that were used
+    in the last grace seconds (by any process that shares the cache folder).
+    The updates of the entries are kept in memory and written to the manifest by save, once per analysed file or batch of images.
+    The manifest is only read, merged and replaced while holding a lock on manifest.json.lock.
+    """
+    folder                      =   None
+    max_size                    =   None
+    grace                       =   None
+    manifest                    =   None
+
+    def __init__(self, folder=DETECTRON_PATH, max_size=DETECTRON_CACHE_MAX_SIZE, grace=DETECTRON_CACHE_GRACE):
+        super().__init__()
+        self.folder = folder
+        self.max_size = max_size
+        self.grace = grace
+        self.manifest_path = os.path.join(folder, MANIFEST_NAME)
+        self.manifest = self.read_manifest()
+        self._removed = set()
+
+    def read_manifest(self):
+        manifest = {"version": CACHE_FORMAT_VERSION, "hashes": {}, "entries": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest.update(json.load(f))
+        return manifest
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds an exclusive lock of the manifest, for processes that share the cache folder
+        """
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        with open(self.manifest_path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save_manifest(self):
+        """
+        Merges the manifest with the one on disk (another process can share the cache folder) and replaces it atomically
+        """
+        with self.locked():
+            self.merge_manifest()
+            self.write_manifest()
+
+    def merge_manifest(self):
+        """
+        Adds the entries of the manifest on disk that are newer or unknown, the entries removed by this process stay removed
+        """
+        disk = self.read_manifest()
+        for path, entry in disk["entries"].items():
+            if path in self._removed:
+                continue
+            if path not in self.manifest["entries"] or self.manifest["entries"][path]["last_used"] < entry["last_used"]:
+                self.manifest["entries"][path] = entry
+        for path, file_hash_entry in disk["hashes"].items():
+            self.manifest["hashes"].setdefault(path, file_hash_entry)
+        self._removed = set()
+
+    def write_manifest(self):
+        tmp_path = self.manifest_path + ".{}.tmp".format(os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def video_hash(self, file_path):
+        """
+        Returns the content hash of a file, the hash is only calculated again when the size or modification time changed
+        :param file_path:       path of the video or image
+        :return:                sha1 hex digest
+        """
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        known = self.manifest["hashes"].get(key)
+        if known is None or known["size"] != stat.st_size or known["mtime"] != stat.st_mtime_ns:
+            known = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_hash(file_path)}
+            self.manifest["hashes"][key] = known
+        return known["hash"]
+
+    def entry_path(self, kind, file_path, device=DETECTRON_DEVICE, options=None):
+        """
+        Returns the path of the cache file of a video and marks it as used. The modification time of an existing cache file is
+        updated, so other processes see that it is used before the manifest is saved.
+        :param kind:            key in CACHE_KINDS (pose_estimation or segmentation)
+        :param file_path:       path of the video or image
+        :param device:          [opt] the device used for inference
+        :param options:         [opt] dict with the inference options that change the predictions
+        :return:                absolute path of the cache file (it does not have to exist yet)
+        """
+        video_hash = self.video_hash(file_path)
+        name = video_hash[:16] + "-" + model_hash(kind, device, options) + CACHE_KINDS[kind][0]
+        rel_path = os.path.join(kind, name)
+        path = os.path.join(self.folder, rel_path)
+
+        now = time.time()
+        entry = self.manifest["entries"].setdefault(rel_path, {
+            "kind"          :   kind,
+            "video_hash"    :   video_hash,
+            "model"         :   model_identity(kind, device, options),
+            "sources"       :   [],
+            "size"          :   0,
+            "created"       :   now,
+        })
+        source = os.path.basename(file_path)
+        if source not in entry["sources"]:
+            entry["sources"].append(source)
+        entry["last_used"] = now
+        self._removed.discard(rel_path)
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+            except OSError:
+                # a file of another user of the cache folder, the manifest is still updated
+                pass
+        return path
+
+    def update(self, path):
+        """
+        Updates the size of an entry after its cache file is closed, the manifest is written by save
+        :param path:            path returned by entry_path
+        """
+        rel_path = os.path.relpath(path, self.folder)
+        if rel_path in self.manifest["entries"]:
+            if os.path.exists(path):
+                entry = self.manifest["entries"][rel_path]
+                entry["size"] = os.path.getsize(path)
+                entry["last_used"] = time.time()
+            else:
+                # nothing was written to the cache file (e.g. no masks of a side video)
+                del self.manifest["entries"][rel_path]
+                self._removed.add(rel_path)
+
+    def save(self):
+        """
+        Writes the updated entries to the manifest and removes old entries if the cache is too large
+        """
+        if self.max_size is not None and self.total_size() > self.max_size:
+            self.prune()
+        else:
+            self.save_manifest()
+
+    def total_size(self):
+        return sum(entry["size"] for entry in self.manifest["entries"].values())
+
+    def stats(self):
+        """
+        :return:                dict with the number of entries, the size and the number of videos of every kind
+        """
+        stats = {}
+        for kind in CACHE_KINDS:
+            entries = [e for e in self.manifest["entries"].values() if e["kind"] == kind]
+            stats[kind] = {
+                "entries"   :   len(entries),
+                "size"      :   sum(e["size"] for e in entries),
+                "videos"    :   len(set(e["video_hash"] for e in entries)),
+                "models"    :   len(set(json.dumps(e["model"], sort_keys=True) for e in entries)),
+            }
+        return stats
+
+    def recently_used(self, rel_path, now):
+        """
+        :return:                True if the entry was used or its file was written in the last grace seconds
+        """
+        last_used = self.manifest["entries"][rel_path]["last_used"]
+        path = os.path.join(self.folder, rel_path)
+        if os.path.exists(path):
+            last_used = max(last_used, os.path.getmtime(path))
+        return now - last_used < self.grace
+
+    def prune(self, max_size=None):
+        """
+        Removes the entries of which the file is missing, and the least recently used entries until the cache fits in max_size.
+        Entries that were used in the last grace seconds are never removed, another process can be writing or reading them.
+        The manifest is merged with the one on disk and locked while the entries are removed.
+        :param max_size:        [opt] maximum size in bytes, the max_size of the cache by default
+        :return:                list of the removed entries (relative paths)
+        """
+        if max_size is None:
+            max_size = self.max_size
+        removed = []
+        with self.locked():
+            self.merge_manifest()
+            now = time.time()
+            for rel_path in list(self.manifest["entries"]):
+                if not os.path.exists(os.path.join(self.folder, rel_path)) and not self.recently_used(rel_path, now):
+                    del self.manifest["entries"][rel_path]
+                    self._removed.add(rel_path)
+
+            total = self.total_size()
+            lru = sorted(self.manifest["entries"].items(), key=lambda item: item[1]["last_used"])
+            for rel_path, entry in lru:
+                if max_size is None or total <= max_size:
+                    break
+                if self.recently_used(rel_path, now):
+                    continue
+                path = os.path.join(self.folder, rel_path)
+                if os.path.exists(path):
+                    os.remove(path)
+                total -= entry["size"]
+                del self.manifest["entries"][rel_path]
+                self._removed.add(rel_path)
+                removed.append(rel_path)
+            self._removed = set()
+            self.write_manifest()
+        return removed
@@ -0,0 +1,93 @@
+import numpy as np
+
+from constants import KEYPOINTS, KPS_ANGLES
+
+
+ANGLES = list(KPS_ANGLES)
+## indices in KEYPOINTS of the 3 points of every angle (angles x 3), the angle is at the middle point
+ANGLE_POINTS = np.array([[KEYPOINTS.index(kp) for kp in KPS_ANGLES[angle]] for angle in ANGLES])
+
+
+def keypoints_to_array(kps_list):
+    """
+    :param kps_list:        list with a keypoints dict (or None) for every frame
+    :return:                array (frames x KEYPOINTS x 2) with the x and y of every keypoint, NaN for missing keypoints
+    """
+    points = np.full((len(kps_list), len(KEYPOINTS), 2), np.nan)
+    for i in range(len(kps_list)):
+        if kps_list[i] is None:
+            continue
+        for k in range(len(KEYPOINTS)):
+            if KEYPOINTS[k] in kps_list[i]:
+                points[i, k] = kps_list[i][KEYPOINTS[k]][:2]
+    return points
+
+
+def store_points(rows):
+    """
+    :param rows:            structured array with the results of the analysed frames (see FrameStore)
+    :return:                array (frames x KEYPOINTS x 2) with the x and y of every keypoint
+    """
+    points = np.empty((len(rows), len(KEYPOINTS), 2))
+    for k in range(len(KEYPOINTS)):
+        points[:, k, 0] = rows[KEYPOINTS[k] + "_x"]
+        points[:, k, 1] = rows[KEYPOINTS[k] + "_y"]
+    return points
+
+
+def sequence_angles(points):
+    """
+    Calculates every angle of KPS_ANGLES in every frame, like get_angle
+    :param points:          array (frames x KEYPOINTS x 2)
+    :return:                array (frames x ANGLES) with the angles in degrees, NaN where a point is missing or coincides with the middle point
+    """
+    a = points[:, ANGLE_POINTS[:, 0]]
+    b = points[:, ANGLE_POINTS[:, 1]]
+    c = points[:, ANGLE_POINTS[:, 2]]
+    ba = a - b
+    bc = c - b
+    dot = ba[..., 0] * bc[..., 0] + ba[..., 1] * bc[..., 1]
+    norm_ba = np.sqrt(ba[..., 0] * ba[..., 0] + ba[..., 1] * ba[..., 1])
+    norm_bc = np.sqrt(bc[..., 0] * bc[..., 0] + bc[..., 1] * bc[..., 1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.degrees(np.arccos(dot / (norm_ba * norm_bc)))
+
+
+def derivative(values, timestamps):
+    """
+    :param values:          array with the values of every frame along the first axis
+    :param timestamps:      array with the timestamp of every frame (seconds)
+    :return:                array with the derivative per second of the values (central differences), 0 with less than 2 frames
+    """
+    if len(timestamps) < 2:
+        return np.zeros(values.shape)
+    return np.gradient(values, timestamps, axis=0)
+
+
+def sequence_kinematics(points, timestamps):
+    """
+    Calculates the kinematics of a sequence of frames at once
+    :param points:          array (frames x KEYPOINTS x 2) with the x and y of every keypoint
+    :param timestamps:      array with the timestamp of every frame (seconds)
+    :return:                dict with
+                                angles: array (frames x ANGLES) with every angle in degrees
+                                angular_velocity: array (frames x ANGLES) in degrees per second
+                                positions: array (frames x KEYPOINTS x 2) with the tracked positions, rounded to pixels
+                                velocity: array (frames x KEYPOINTS x 2) with the velocity of every keypoint in pixels per second
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    angles = sequence_angles(points)
+    return {
+        "angles"            :   angles,
+        "angular_velocity"  :   derivative(angles, timestamps),
+        "positions"         :   np.round(points),
+        "velocity"          :   derivative(points, timestamps),
+    }
+
+
+def frame_angles(kps):
+    """
+    :param kps:             keypoints dict of one frame
+    :return:                dict with every angle of KPS_ANGLES in degrees
+    """
+    return dict(zip(ANGLES, sequence_angles(keypoints_to_array([kps]))[0]))
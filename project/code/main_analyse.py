@@ -1,7 +1,8 @@
 import os
 import argparse
 from CycloComparer import *
-from config import ANALYSE_RATE
+from config import ANALYSE_RATE, DETECTRON_BATCH_SIZE, DETECTRON_INFERENCE_SCALE
+from constants import PLOT_WORKERS
 
 
 """----------------------------- Main options -----------------------------"""
@@ -11,8 +12,18 @@ parser.add_argument("--pose-folder", default=None)
 parser.add_argument("--seg-folder", default=None)
 parser.add_argument('--mask-interest-folder', default=None)
 parser.add_argument("--plot-folder", default="plots/analysis", dest="PLOT_FOLDER")
-parser.add_argument("--analyse-rate", default=ANALYSE_RATE)
+parser.add_argument("--analyse-rate", type=int, nargs="+", default=ANALYSE_RATE, help="one or more analyse rates, the frames are decoded and predicted once for all rates")
 parser.add_argument("--img-set", nargs="*", default=None)
+parser.add_argument("--batch-size", type=int, default=DETECTRON_BATCH_SIZE, help="number of frames or images predicted by detectron2 at once")
+parser.add_argument("--pipeline", action="store_true", default=False, help="decode, analyse and write the visualization in separate threads")
+parser.add_argument("--workers", type=int, default=1, help="number of processes that analyse files in parallel")
+parser.add_argument("--sampling-budget", type=float, default=None, help="select the frames based on the motion, with on average this number of frames per second of video")
+parser.add_argument("--roi", action="store_true", default=False, help="predict with detectron2 on a crop around the person of the previous frame")
+parser.add_argument("--inference-scale", type=float, default=DETECTRON_INFERENCE_SCALE, help="size of the input of detectron2 relative to the default input size of the models (e.g. 0.5)")
+parser.add_argument("--vis-every", type=int, default=1, help="render every Nth frame of the visualizations, 0 for only the summary images")
+parser.add_argument("--no-vis", action="store_true", default=False, help="headless: no visualizations, no summary images and no drawing")
+parser.add_argument("--plot-workers", type=int, default=PLOT_WORKERS, help="number of background processes that make the plots, 0 to plot in the main process")
+parser.add_argument("--report", action="store_true", default=False, help="save all plots as the pages of one PDF (report.pdf) instead of separate files")
 
 
 args = parser.parse_args()
@@ -21,5 +32,5 @@ args = parser.parse_args()
 com = CycloComparer()
 com.setup(data_folder=args.dataset, analyse_rate=args.analyse_rate, \
     pose_estimation_folder=args.pose_folder, segmentation_folder=args.seg_folder, mask_interest_folder=args.mask_interest_folder, \
-        img_set=args.img_set)
-com.compare(visualize=True, plot_path=args.PLOT_FOLDER)
\ No newline at end of file
+        img_set=args.img_set, pipelined=args.pipeline, batch_size=args.batch_size, workers=args.workers, sampling_budget=args.sampling_budget, roi=args.roi, inference_scale=args.inference_scale, render_every=args.vis_every, plot_workers=args.plot_workers)
+com.compare(visualize=not args.no_vis, plot_path=args.PLOT_FOLDER, report=args.report)
\ No newline at end of file
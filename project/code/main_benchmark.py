@@ -0,0 +1,253 @@
+import os
+import argparse
+import time
+import numpy as np
+import cv2
+
+from config import ANALYSE_RATE
+from get_data import get_mask
+from evaluate_segmentation import evaluate_mask_batch
+from constants import MASK_BOX_EXPAND
+
+
+def loop_confusion_counts(gt_mask, data_mask):
+    """
+    Reference implementation of the confusion matrix of one mask that walks every pixel of the expanded box in Python,
+    the box is calculated with cv2.boundingRect like the original evaluate_mask
+    param gt_mask:          ground truth mask with values 0 and 255
+    param data_mask:        predicted mask with values 0 and 255
+    returns:                p, n, tp, tn, fp, fn
+    """
+    r_x, r_y, r_w, r_h = cv2.boundingRect(cv2.findNonZero(gt_mask))
+    e = MASK_BOX_EXPAND
+    x1 = max(r_x - int(e*r_w), 0)
+    y1 = max(r_y - int(e*r_h), 0)
+    x2 = min(r_x + int((1+e)*r_w), gt_mask.shape[1])
+    y2 = min(r_y + int((1+e)*r_h), gt_mask.shape[0])
+    gt_box = gt_mask[y1:y2, x1:x2]
+    data_box = data_mask[y1:y2, x1:x2]
+    p, n, tp, tn, fp, fn = 0, 0, 0, 0, 0, 0
+    for gt_r, data_r in zip(gt_box, data_box):
+        for gt, data in zip(gt_r, data_r):
+            if gt == 255:
+                p += 1
+            elif gt == 0:
+                n += 1
+            if gt == 255 and data == 255:
+                tp += 1
+            elif gt == 0 and data == 0:
+                tn += 1
+            elif gt == 0 and data == 255:
+                fp += 1
+            elif gt == 255 and data == 0:
+                fn += 1
+    return p, n, tp, tn, fp, fn
+
+
+def bench_masks(dataset_folder, lib, repeat=1):
+    """
+    Compares the pixel loop with the vectorized mask metrics on the masks of one segmentation library
+    param dataset_folder:   the dataset folder with GROUND_TRUTH/SEGMENTATION and SEGMENTATION/<lib>
+    param lib:              name of the segmentation library to use
+    param repeat:           [opt] number of times the vectorized version is repeated
+    """
+    ground_truth_folder = os.path.join(dataset_folder, "GROUND_TRUTH/SEGMENTATION")
+    data_folder = os.path.join(dataset_folder, "SEGMENTATION", lib)
+    files = sorted(os.listdir(data_folder))
+    gt_masks = [get_mask(os.path.join(ground_truth_folder, f)) for f in files]
+    data_masks = [get_mask(os.path.join(data_folder, f)) for f in files]
+
+    start = time.time()
+    loop_counts = [loop_confusion_counts(gt, data) for gt, data in zip(gt_masks, data_masks)]
+    loop_time = time.time() - start
+
+    start = time.time()
+    for r in range(repeat):
+        metrics = evaluate_mask_batch(gt_masks, data_masks)
+    vec_time = (time.time() - start) / repeat
+
+    for (p, n, tp, tn, fp, fn), met in zip(loop_counts, metrics):
+        assert met["ACC"] == (tp + tn) / (p + n) and met["TPR"] == tp / p and met["TNR"] == tn / n
+
+    print('MASKS     : {:10d} ({})'.format(len(files), "x".join(str(s) for s in gt_masks[0].shape)))
+    print('LOOP      : {:10f}'.format(round(loop_time, 4)))
+    print('VECTOR    : {:10f}'.format(round(vec_time, 4)))
+    print('SPEED-UP  : {:10.1f}x'.format(loop_time / vec_time))
+
+
+def bench_pipeline(video_path, analyse_rate, pose_folder=None, seg_folder=None, mask_interest_folder=None, vis_folder="/tmp"):
+    """
+    Compares the serial analysis of a video with the pipelined analysis and reports the utilization of every stage
+    param video_path:           the video to analyse
+    param analyse_rate:         the number of frames per second that are analysed
+    param pose_folder:          [opt] folder with the pose estimation data, detectron2 is used if not given
+    param seg_folder:           [opt] folder with the segmentation data, detectron2 is used if not given
+    param mask_interest_folder: [opt] folder with the masks of interest
+    param vis_folder:           [opt] folder where the visualization videos are written
+    """
+    from CycloDetector import CycloDetector
+    detector = CycloDetector()
+    outputs = {}
+    for pipelined in [False, True]:
+        name = "pipeline" if pipelined else "serial"
+        vis_path = os.path.join(vis_folder, "bench_" + name + os.path.splitext(video_path)[1])
+        detector.setup(video_path, analyse_rate, pose_folder, seg_folder, mask_interest_folder)
+        start = time.time()
+        outputs[name] = detector.analyse(vis_path=vis_path, pipelined=pipelined)
+        print('{:10s}: {:10f}'.format(name.upper(), round(time.time() - start, 4)))
+    
+    stats = detector.pipeline_stats
+    print('FRAMES    : {:10d}'.format(stats["frames"]))
+    for stage in ["decode", "inference", "write"]:
+        print('{:10s}: {:9.1f}%'.format(stage.upper(), 100 * stats[stage]))
+    
+    serial, pipelined = outputs["serial"], outputs["pipeline"]
+    identical = serial[0] == pipelined[0] and np.array_equal(serial[4], pipelined[4]) \
+        and all(np.array_equal(serial[2][kp]["points"], pipelined[2][kp]["points"]) for kp in serial[2])
+    print('IDENTICAL : {:>10s}'.format(str(identical)))
+
+
+def bench_inference(video_path, batch_sizes, n_frames=32):
+    """
+    Measures the throughput of detectron2 (frames per second) for different batch sizes
+    param video_path:           the video from which the frames are taken
+    param batch_sizes:          list of batch sizes to test
+    param n_frames:             [opt] number of frames that are predicted for every batch size
+    """
+    from detectron import get_detectron
+    from frame_source import FrameSource
+    detectron = get_detectron()
+    source = FrameSource(video_path)
+    frames = []
+    while len(frames) < n_frames:
+        frame, frame_number, timestamp = source.read()
+        if frame is None:
+            break
+        frames.append(frame)
+    source.release()
+
+    # the models are loaded before the timing
+    detectron.predict_keypoints_batch(frames[:1])
+    detectron.predict_mask_panoptic_batch(frames[:1])
+    print('{:>10s} {:>12s} {:>12s}'.format("BATCH", "KPS FPS", "MASK FPS"))
+    for batch_size in batch_sizes:
+        fps = []
+        for predict in [detectron.predict_keypoints_batch, detectron.predict_mask_panoptic_batch]:
+            start = time.time()
+            for i in range(0, len(frames), batch_size):
+                predict(frames[i:i+batch_size])
+            fps.append(len(frames) / (time.time() - start))
+        print('{:10d} {:12.2f} {:12.2f}'.format(batch_size, fps[0], fps[1]))
+
+
+def bench_mask_cache(seg_folder_path, cache_path="/tmp/bench.masks"):
+    """
+    Compares the size on disk and the read throughput of a folder with a JPEG mask per frame and the same masks in a MaskCache
+    param seg_folder_path:      folder with the JPEG masks
+    param cache_path:           [opt] filename of the mask cache that is created for the benchmark
+    """
+    from mask_cache import MaskCache
+    files = sorted(f for f in os.listdir(seg_folder_path) if f.endswith(".jpg"))
+    cache = MaskCache(cache_path)
+    for i in range(len(files)):
+        cache.put(i, get_mask(os.path.join(seg_folder_path, files[i])))
+    cache.close()
+
+    start = time.time()
+    jpeg_masks = [get_mask(os.path.join(seg_folder_path, f)) for f in files]
+    jpeg_time = time.time() - start
+
+    start = time.time()
+    cache = MaskCache(cache_path)
+    cache_masks = [cache.get(i) for i in range(len(files))]
+    cache_time = time.time() - start
+    cache.close()
+
+    identical = all(np.array_equal(a, b) for a, b in zip(jpeg_masks, cache_masks))
+    jpeg_size = sum(os.path.getsize(os.path.join(seg_folder_path, f)) for f in files)
+    cache_size = os.path.getsize(cache_path)
+    os.remove(cache_path)
+
+    print('MASKS     : {:10d}'.format(len(files)))
+    print('JPEG SIZE : {:10.2f} MB'.format(jpeg_size / 1e6))
+    print('CACHE SIZE: {:10.2f} MB'.format(cache_size / 1e6))
+    print('JPEG READ : {:10.1f} masks/s'.format(len(files) / jpeg_time))
+    print('CACHE READ: {:10.1f} masks/s'.format(len(files) / cache_time))
+    print('IDENTICAL : {:>10s}'.format(str(identical)))
+
+
+def bench_scale(dataset_folder, scales, threshold=5):
+    """
+    Measures the throughput of detectron2 and the accuracy of its keypoints and masks on the ground truth images of a dataset
+    for different inference scales, with the metrics of evaluate_pose and evaluate_segmentation.
+    The loss of a scale is the difference of its accuracy with the accuracy of the first scale.
+    param dataset_folder:       the dataset folder with GROUND_TRUTH/images, GROUND_TRUTH/POSE_ESTIMATION and GROUND_TRUTH/SEGMENTATION
+    param scales:               list of inference scales to test, the first one is the reference (e.g. 1.0)
+    param threshold:            [opt] threshold of the keypoint accuracy (see keypoints_accuracy)
+    """
+    from detectron import get_detectron
+    from evaluate_pose import load_ground_truth, fill_keypoints, normalized_distances, keypoints_accuracy, group_metrics
+    from evaluate_segmentation import evaluate_mask_batch, reduce_mask_metrics
+    ground_truth_folder = os.path.join(dataset_folder, "GROUND_TRUTH")
+    files, ground_kps, diagonals = load_ground_truth(os.path.join(ground_truth_folder, "POSE_ESTIMATION"))
+    names = [f.split(".")[0] for f in files]
+    images = [cv2.imread(os.path.join(ground_truth_folder, "images", n + ".jpg")) for n in names]
+    gt_masks = [get_mask(os.path.join(ground_truth_folder, "SEGMENTATION", n + ".jpg")) for n in names]
+
+    detectron = get_detectron()
+    # the models are loaded before the timing
+    detectron.predict_keypoints_batch(images[:1])
+    detectron.predict_mask_panoptic_batch(images[:1])
+    
+    results = []
+    for scale in scales:
+        start = time.time()
+        kps_list = [detectron.predict_keypoints_batch([img], scale=scale)[0] for img in images]
+        kps_fps = len(images) / (time.time() - start)
+        start = time.time()
+        masks = [detectron.predict_mask_panoptic_batch([img], scale=scale)[0] for img in images]
+        mask_fps = len(images) / (time.time() - start)
+
+        data_kps = np.zeros(ground_kps.shape)
+        for i in range(len(kps_list)):
+            fill_keypoints(data_kps[i], kps_list[i])
+        acc, avg_dist = keypoints_accuracy(normalized_distances(ground_kps, diagonals, data_kps), ground_kps, threshold)
+        acc, avg_dist = group_metrics(acc), group_metrics(avg_dist)
+        mask_metrics = reduce_mask_metrics(evaluate_mask_batch(gt_masks, masks), len(masks))
+        results.append((scale, kps_fps, mask_fps, acc["All"], avg_dist["All"], mask_metrics["ACC"], mask_metrics["TPR"]))
+
+    print('IMAGES    : {:10d} ({})'.format(len(images), "x".join(str(s) for s in images[0].shape[:2])))
+    print('{:>8s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}'.format(
+        "SCALE", "KPS FPS", "MASK FPS", "KPS ACC", "KPS DIST", "MASK ACC", "MASK TPR", "KPS LOSS", "MASK LOSS"))
+    for scale, kps_fps, mask_fps, kps_acc, kps_dist, mask_acc, mask_tpr in results:
+        print('{:8.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f}'.format(
+            scale, kps_fps, mask_fps, 100 * kps_acc, kps_dist, 100 * mask_acc, 100 * mask_tpr,
+            100 * (results[0][3] - kps_acc), 100 * (results[0][5] - mask_acc)))
+
+
+"""----------------------------- Main options -----------------------------"""
+parser = argparse.ArgumentParser(description="Benchmarks for the evaluation and analysis code")
+parser.add_argument("benchmark", choices=["masks", "pipeline", "inference", "maskcache", "scale"])
+parser.add_argument("dataset", type=str, help="dataset folder (masks, scale), video file (pipeline, inference) or folder with JPEG masks (maskcache)")
+parser.add_argument("--lib", default="detectron2_pan")
+parser.add_argument("--repeat", type=int, default=5)
+parser.add_argument("--pose-folder", default=None)
+parser.add_argument("--seg-folder", default=None)
+parser.add_argument("--mask-interest-folder", default=None)
+parser.add_argument("--analyse-rate", default=ANALYSE_RATE)
+parser.add_argument("--batch-sizes", type=int, nargs="*", default=[1, 2, 4, 8])
+parser.add_argument("--frames", type=int, default=32)
+parser.add_argument("--scales", type=float, nargs="*", default=[1.0, 0.75, 0.5])
+parser.add_argument("--kps-threshold", type=int, default=5)
+args = parser.parse_args()
+
+if args.benchmark == "masks":
+    bench_masks(args.dataset, args.lib, args.repeat)
+elif args.benchmark == "pipeline":
+    bench_pipeline(args.dataset, args.analyse_rate, args.pose_folder, args.seg_folder, args.mask_interest_folder)
+elif args.benchmark == "inference":
+    bench_inference(args.dataset, args.batch_sizes, args.frames)
+elif args.benchmark == "maskcache":
+    bench_mask_cache(args.dataset)
+elif args.benchmark == "scale":
+    bench_scale(args.dataset, args.scales, args.kps_threshold)
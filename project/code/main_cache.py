@@ -0,0 +1,86 @@
+import os
+import shutil
+import argparse
+from config import DETECTRON_PATH, DETECTRON_CACHE_MAX_SIZE, DETECTRON_CACHE_GRACE
+from frame_source import IMG_TYPES, VID_TYPES
+from inference_cache import InferenceCache
+from mask_cache import convert_jpeg_cache
+from pose_cache import convert_json_cache
+
+
+def convert_legacy_caches(cache, file_path):
+    """
+    Moves the caches of a file that are keyed by its name (<kind>/<file_basename>...) to the content addressed inference cache.
+    The caches are assumed to be predicted by the current models.
+    :param cache:           InferenceCache object
+    :param file_path:       the image or video of which the caches were made
+    :return:                list with the kinds that were converted
+    """
+    file_basename = os.path.basename(file_path).split(".")[0]
+    converted = []
+    legacy = {
+        "pose_estimation"   :   [(".kps", shutil.copyfile), (".json", convert_json_cache)],
+        "segmentation"      :   [(".masks", shutil.copyfile), ("", convert_jpeg_cache)],
+    }
+    for kind in legacy:
+        cache_path = cache.entry_path(kind, file_path)
+        for ext, convert in legacy[kind]:
+            legacy_path = os.path.join(cache.folder, kind, file_basename + ext)
+            if os.path.exists(cache_path) or not os.path.exists(legacy_path):
+                continue
+            if not os.path.exists(os.path.dirname(cache_path)):
+                os.makedirs(os.path.dirname(cache_path))
+            convert(legacy_path, cache_path)
+            converted.append(kind)
+        cache.update(cache_path)
+    return converted
+
+
+def size_to_string(size):
+    return '{:.2f} MB'.format(size / 1024**2)
+
+
+"""----------------------------- Main options -----------------------------"""
+parser = argparse.ArgumentParser(description="Manage the detectron2 cache that is used when analysing videos")
+parser.add_argument("command", choices=["convert", "stats", "prune"])
+parser.add_argument("--cache-folder", default=DETECTRON_PATH)
+parser.add_argument("--videos", default=None, help="convert: folder with the videos (and images) of the old caches")
+parser.add_argument("--max-size", default=None, type=float, help="prune: maximum size of the cache in GB")
+parser.add_argument("--grace", default=None, type=float, help="prune: never remove the entries used in the last minutes, {} by default".format(DETECTRON_CACHE_GRACE // 60))
+args = parser.parse_args()
+
+max_size = DETECTRON_CACHE_MAX_SIZE
+if args.max_size is not None:
+    max_size = int(args.max_size * 1024**3)
+grace = DETECTRON_CACHE_GRACE
+if args.grace is not None:
+    grace = args.grace * 60
+cache = InferenceCache(args.cache_folder, max_size, grace)
+
+if args.command == "convert":
+    # the old caches are keyed by the name of the video, so the videos are needed to find their content hash
+    if args.videos is None:
+        parser.error("convert needs the folder with the videos: --videos FOLDER")
+    for f in sorted(os.listdir(args.videos)):
+        if os.path.splitext(f)[1] in IMG_TYPES + VID_TYPES:
+            converted = convert_legacy_caches(cache, os.path.join(args.videos, f))
+            print('\t {:20s} : {}'.format(f, ", ".join(converted)))
+    cache.save()
+
+if args.command == "stats":
+    stats = cache.stats()
+    for kind in stats:
+        print(kind)
+        print('\t {:10s} : {:10d}'.format("entries", stats[kind]["entries"]))
+        print('\t {:10s} : {:10d}'.format("videos", stats[kind]["videos"]))
+        print('\t {:10s} : {:10d}'.format("models", stats[kind]["models"]))
+        print('\t {:10s} : {:>10s}'.format("size", size_to_string(stats[kind]["size"])))
+    print('{:18s} : {:>10s}'.format("TOTAL", size_to_string(cache.total_size())))
+    if max_size is not None:
+        print('{:18s} : {:>10s}'.format("MAX", size_to_string(max_size)))
+
+if args.command == "prune":
+    removed = cache.prune(max_size)
+    for rel_path in removed:
+        print('\t REMOVED {}'.format(rel_path))
+    print('{:18s} : {:>10s}'.format("TOTAL", size_to_string(cache.total_size())))
@@ -1,6 +1,7 @@
 import os
 import argparse
-from evaluate_pose import compare_libs_keypoints_distances
+import numpy as np
+from evaluate_pose import load_libs_distances, compare_libs_keypoints_distances, compare_libs_pck_curves
 from evaluate_segmentation import compare_libs_masks
 
 
@@ -10,8 +11,10 @@ parser.add_argument("dataset", type=str)
 parser.add_argument("--compare-pose", action="store_true", default=False)
 parser.add_argument("--compare-segmentation", action="store_true", default=False)
 parser.add_argument("--kps-threshold", type=int, default=5, dest="KPS_THRESHOLD")
+parser.add_argument("--kps-sweep", type=float, nargs=3, default=None, metavar=("START", "STOP", "STEP"), dest="KPS_SWEEP")
 parser.add_argument("--plot-folder", default="plots/evaluation", dest="PLOT_FOLDER")
 parser.add_argument("--img-set", nargs="*", default=None)
+parser.add_argument("--workers", type=int, default=1, help="number of processes that evaluate the libraries and images in parallel")
 args = parser.parse_args()
 
 if args.compare_pose:
@@ -20,7 +23,13 @@ if args.compare_pose:
     PLOT_FOLDER_POSE = os.path.join(args.PLOT_FOLDER,"pose")
     if not os.path.exists(PLOT_FOLDER_POSE):
         os.makedirs(PLOT_FOLDER_POSE)
-    compare_libs_keypoints_distances(PLOT_FOLDER_POSE, args.dataset, args.KPS_THRESHOLD, args.img_set)
+    # the keypoints are read and the distances calculated once for the accuracy and the accuracy curves
+    distances = load_libs_distances(args.dataset, args.img_set, args.workers)
+    compare_libs_keypoints_distances(PLOT_FOLDER_POSE, args.dataset, args.KPS_THRESHOLD, args.img_set, args.workers, distances)
+    if args.KPS_SWEEP is not None:
+        start, stop, step = args.KPS_SWEEP
+        thresholds = np.arange(start, stop + step/2, step)
+        compare_libs_pck_curves(PLOT_FOLDER_POSE, args.dataset, thresholds, args.img_set, args.workers, distances)
 
 
 if args.compare_segmentation:
@@ -29,7 +38,7 @@ if args.compare_segmentation:
     PLOT_FOLDER_SEG = os.path.join(args.PLOT_FOLDER,"seg")
     if not os.path.exists(PLOT_FOLDER_SEG):
         os.makedirs(PLOT_FOLDER_SEG)
-    compare_libs_masks(PLOT_FOLDER_SEG, args.dataset, args.img_set)
+    compare_libs_masks(PLOT_FOLDER_SEG, args.dataset, args.img_set, args.workers)
 
 
 #import sys
@@ -0,0 +1,48 @@
+import time
+import argparse
+from CycloDetector import CycloDetector
+from realtime import RealtimeAnalyser
+from config import ANALYSE_RATE, DETECTRON_INFERENCE_SCALE
+from constants import REALTIME_LATENCY_TARGET
+
+
+"""----------------------------- Main options -----------------------------"""
+parser = argparse.ArgumentParser(description="Analyse a cyclist on a camera (or a video at the speed of the wall clock) in real time")
+parser.add_argument("source", type=str, help="camera index or a video that is read at the speed of the wall clock")
+parser.add_argument("--pose-folder", default=None)
+parser.add_argument("--seg-folder", default=None)
+parser.add_argument('--mask-interest-folder', default=None)
+parser.add_argument("--latency-target", type=float, default=REALTIME_LATENCY_TARGET, help="maximum time in seconds between the capture of a frame and its result")
+parser.add_argument("--skip-masks", action="store_true", default=False, help="skip the mask inference when the analysis is behind")
+parser.add_argument("--duration", type=float, default=None, help="stop after this number of seconds")
+parser.add_argument("--print-interval", type=float, default=1.0, help="number of seconds between the printed running results")
+parser.add_argument("--roi", action="store_true", default=False, help="predict with detectron2 on a crop around the person of the previous frame")
+parser.add_argument("--inference-scale", type=float, default=DETECTRON_INFERENCE_SCALE, help="size of the input of detectron2 relative to the default input size of the models (e.g. 0.5)")
+args = parser.parse_args()
+
+source = int(args.source) if args.source.isdigit() else args.source
+name = "camera" + args.source if isinstance(source, int) else args.source
+
+detector = CycloDetector()
+detector.setup(name, ANALYSE_RATE, args.pose_folder, args.seg_folder, args.mask_interest_folder, roi=args.roi, inference_scale=args.inference_scale, live=True, visualize=False)
+analyser = RealtimeAnalyser(detector, args.latency_target, args.skip_masks)
+
+last_print = time.time()
+for res in analyser.run(source, args.duration):
+    if time.time() - last_print >= args.print_interval:
+        last_print = time.time()
+        summary = detector.summary.values()
+        line = '{:8.2f}s {:6d} frames, latency {:6.3f}s'.format(res["timestamp"], summary["frames"], res["latency"])
+        if summary["area"] is not None:
+            line += ', area {:8.0f} (std {:7.1f})'.format(summary["area"]["AREA_MEAN"], summary["area"]["AREA_STD"])
+        for angle in summary["angles"]:
+            line += ', {} {:6.1f}'.format(angle, summary["angles"][angle]["mean"])
+        print(line)
+
+report = analyser.report()
+print("\nREAL-TIME ANALYSIS ({})".format(detector.orientation))
+print('\t {:14s} : {:10.2f}'.format("fps", report["fps"]))
+for key in ["read", "analysed", "dropped", "stale", "masks_skipped", "no_person"]:
+    print('\t {:14s} : {:10d}'.format(key, report[key]))
+for key in ["latency_p50", "latency_p90", "latency_p99"]:
+    print('\t {:14s} : {:10f}'.format(key, report[key]))
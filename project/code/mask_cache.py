@@ -0,0 +1,197 @@
+import os
+import fcntl
+import cv2
+import numpy as np
+
+from get_data import get_mask
+
+
+MASK_CACHE_MAGIC = b"CYMASK01"
+MASK_CACHE_HEADER = np.dtype([("magic", "S8"), ("height", "<u4"), ("width", "<u4")])
+MASK_RECORD_HEADER = np.dtype([("frame", "<i8"), ("y1", "<u4"), ("x1", "<u4"), ("y2", "<u4"), ("x2", "<u4")])
+
+
+class MaskCache:
+    """
+    Lossless cache of all masks of one video in a single file.
+    The file starts with a header (magic, height, width) followed by a record for every frame: the frame number,
+    the bounding box of the segmentation and the bit-packed pixels inside that box.
+    The file is memory-mapped, so reading a mask only unpacks the bits of that frame.
+    The file is locked while a writer has it open (the cache folder can be shared), a cache of which the file is locked
+    by another writer is read only and keeps the masks it predicts bit-packed in memory.
+    """
+    path                        =   None
+    shape                       =   None
+    index                       =   None
+    read_only                   =   False
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.shape = None
+        self.index = {}
+        self.read_only = False
+        self._memory = {}
+        self._data = None
+        self._file = None
+        self._end = MASK_CACHE_HEADER.itemsize
+        if self.read_header():
+            self.read_index()
+
+    def read_header(self):
+        """
+        Reads the shape of the masks from the header of the file
+        :return:                False if the file does not have a header yet
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < MASK_CACHE_HEADER.itemsize:
+            return False
+        header = np.fromfile(self.path, dtype=MASK_CACHE_HEADER, count=1)[0]
+        if header["magic"] != MASK_CACHE_MAGIC:
+            raise ValueError("Not a mask cache file: " + self.path)
+        self.shape = (int(header["height"]), int(header["width"]))
+        return True
+
+    def read_index(self):
+        """
+        Walks over the record headers to build the index of frame number to (offset, box)
+        An incomplete record at the end of the file (e.g. after a crash) is ignored.
+        """
+        self.index = {}
+        self._data = None
+        data = self.data()
+        offset = MASK_CACHE_HEADER.itemsize
+        while offset + MASK_RECORD_HEADER.itemsize <= len(data):
+            record = data[offset:offset + MASK_RECORD_HEADER.itemsize].view(MASK_RECORD_HEADER)[0]
+            box = (int(record["y1"]), int(record["x1"]), int(record["y2"]), int(record["x2"]))
+            bits_offset = offset + MASK_RECORD_HEADER.itemsize
+            end = bits_offset + packed_size(box)
+            if end > len(data) or not (box[0] <= box[2] <= self.shape[0] and box[1] <= box[3] <= self.shape[1]):
+                break
+            self.index[int(record["frame"])] = (bits_offset, box)
+            offset = end
+        self._end = offset
+
+    def data(self):
+        """
+        :return:                the memory-mapped bytes of the file
+        """
+        if self._data is None or len(self._data) < self._end:
+            if self._file is not None:
+                self._file.flush()
+            self._data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        return self._data
+
+    def __contains__(self, frame_number):
+        return frame_number in self.index or frame_number in self._memory
+
+    def __len__(self):
+        return len(self.index) + len(self._memory)
+
+    def frames(self):
+        return sorted(list(self.index.keys()) + list(self._memory.keys()))
+
+    def get(self, frame_number):
+        """
+        :param frame_number:    the frame number of the mask
+        :return:                one channel mask with values 0 and 255, or None if the frame is not in the cache
+        """
+        if frame_number in self._memory:
+            box, bits = self._memory[frame_number]
+        elif frame_number in self.index:
+            offset, box = self.index[frame_number]
+            bits = self.data()[offset:offset + packed_size(box)]
+        else:
+            return None
+        y1, x1, y2, x2 = box
+        mask = np.zeros(self.shape, dtype=np.uint8)
+        n = (y2 - y1) * (x2 - x1)
+        if n > 0:
+            mask[y1:y2, x1:x2] = (np.unpackbits(bits, count=n) * 255).reshape(y2 - y1, x2 - x1)
+        return mask
+
+    def put(self, frame_number, mask):
+        """
+        Appends the mask of a frame to the cache file, a mask with a value > 0 is seen as part of the segmentation
+        :param frame_number:    the frame number of the mask
+        :param mask:            one channel mask
+        """
+        if self._file is None and not self.read_only:
+            self.open_writer(mask.shape[:2])
+        if self.shape is None:
+            self.shape = mask.shape[:2]
+        if mask.shape[:2] != self.shape:
+            raise ValueError("Mask shape {} does not match the cache shape {}".format(mask.shape[:2], self.shape))
+
+        points = cv2.findNonZero(mask)
+        x, y, w, h = cv2.boundingRect(points) if points is not None else (0, 0, 0, 0)
+        box = (y, x, y + h, x + w)
+        record = np.array([(frame_number, ) + box], dtype=MASK_RECORD_HEADER)
+        bits = np.packbits(mask[y:y+h, x:x+w].reshape(-1) > 0)
+        if self.read_only:
+            self._memory[int(frame_number)] = (box, bits)
+            return
+        self._file.write(record.tobytes())
+        self._file.write(bits.tobytes())
+        self.index[int(frame_number)] = (self._end + MASK_RECORD_HEADER.itemsize, box)
+        self._end += MASK_RECORD_HEADER.itemsize + len(bits)
+
+    def open_writer(self, shape):
+        """
+        Opens and locks the file for appending, the header and the index are read again because another writer can have
+        added masks since the cache was opened. If another writer has the lock the cache becomes read only.
+        :param shape:           shape of the masks, written in the header of a new file
+        """
+        folder = os.path.dirname(self.path)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+        f = open(self.path, "a+b")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            self.read_only = True
+            return
+        if self.read_header():
+            self.read_index()
+            # an incomplete last record of an interrupted writer is removed
+            f.truncate(self._end)
+        else:
+            f.truncate(0)
+            self.shape = shape
+            header = np.array([(MASK_CACHE_MAGIC, self.shape[0], self.shape[1])], dtype=MASK_CACHE_HEADER)
+            f.write(header.tobytes())
+            f.flush()
+            self.index = {}
+            self._end = MASK_CACHE_HEADER.itemsize
+        self._data = None
+        self._file = f
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._data = None
+
+
+def packed_size(box):
+    y1, x1, y2, x2 = box
+    return ((y2 - y1) * (x2 - x1) + 7) // 8
+
+
+def convert_jpeg_cache(seg_folder_path, cache_path):
+    """
+    Converts a folder with a JPEG mask per frame (<frame_number>.jpg) to a MaskCache file
+    :param seg_folder_path: folder with the JPEG masks
+    :param cache_path:      the filename of the new mask cache
+    :return:                the number of converted masks
+    """
+    cache = MaskCache(cache_path)
+    n = 0
+    for f in sorted(os.listdir(seg_folder_path)):
+        name, ext = os.path.splitext(f)
+        if ext != ".jpg" or not name.isdigit() or int(name) in cache:
+            continue
+        cache.put(int(name), get_mask(os.path.join(seg_folder_path, f)))
+        n += 1
+    cache.close()
+    return n
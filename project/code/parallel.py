@@ -0,0 +1,27 @@
+import cv2
+import multiprocessing
+
+
+def init_worker():
+    # the work is spread over the processes, so every process uses one thread
+    cv2.setNumThreads(1)
+
+
+def call_job(job):
+    function, args = job[0], job[1:]
+    return function(*args)
+
+
+def parallel_map(jobs, workers=1):
+    """
+    Runs a list of jobs in a pool of worker processes, or in this process if workers <= 1.
+    The pool uses fork, the main scripts are not guarded against being imported again by spawn.
+    :param jobs:            list of tuples (function, arg1, arg2, ...), the function has to be defined at module level
+    :param workers:         [opt] number of processes
+    :return:                list with the return value of every job, in the order of jobs
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [call_job(job) for job in jobs]
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(min(workers, len(jobs)), initializer=init_worker) as pool:
+        return list(pool.imap(call_job, jobs))
@@ -0,0 +1,72 @@
+import time
+import queue
+import threading
+
+
+class PipelineStage(threading.Thread):
+    """
+    Thread of the analysis pipeline that keeps track of the time it is busy.
+    An exception in the thread is stored and raised again in the main thread by join_stage().
+    """
+    busy_time                   =   None
+    error                       =   None
+
+    def __init__(self, queue_size):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.busy_time = 0.0
+        self.error = None
+
+    def put(self, item):
+        """
+        Puts an item in the queue of the stage, blocks while the queue is full (backpressure) unless the stage is stopped
+        """
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def join_stage(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+class FramePrefetcher(PipelineStage):
+    """
+    Decodes the frames of a FrameSource ahead of the analysis into a bounded queue
+    """
+
+    def __init__(self, frame_source, queue_size):
+        super().__init__(queue_size)
+        self.frame_source = frame_source
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                start = time.time()
+                item = self.frame_source.read()
+                self.busy_time += time.time() - start
+                self.put(item)
+                if item[0] is None:
+                    break
+        except Exception as e:
+            self.error = e
+            self.put((None, None, None))
+
+    def get(self):
+        """
+        :return:                frame, frame_number, timestamp of the next frame or None, None, None at the end of the source
+        """
+        frame, frame_number, timestamp = self.queue.get()
+        if frame is None and self.error is not None:
+            raise self.error
+        return frame, frame_number, timestamp
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
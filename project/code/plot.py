@@ -1,5 +1,109 @@
+import os
+import multiprocessing
 import numpy as np
-import matplotlib.pyplot as plt
+
+from constants import PLOT_WORKERS
+
+
+## multi-page report of the process that the figures are saved to instead of separate files (see PlotPool)
+_report = None
+_report_folder = None
+
+
+def save_figure(fig, save_path):
+    """
+    Saves a figure to save_path or, when a report is open, as a page of the report with save_path at the bottom of the page
+    """
+    if _report is not None:
+        fig.text(0.01, 0.01, os.path.relpath(save_path, _report_folder), fontsize='small')
+        _report.savefig(fig)
+    else:
+        fig.savefig(save_path)
+
+
+def open_report(report_path):
+    global _report, _report_folder
+    from matplotlib.backends.backend_pdf import PdfPages
+    _report = PdfPages(report_path)
+    _report_folder = os.path.dirname(report_path)
+
+
+def close_report():
+    global _report
+    if _report is not None:
+        _report.close()
+        _report = None
+
+
+def init_plot_worker(report_path):
+    """
+    Initializes a worker process of a PlotPool: matplotlib is imported with the Agg backend (no display)
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    if report_path is not None:
+        open_report(report_path)
+
+
+def run_plot_job(plot_function, args, kwargs):
+    plot_function(*args, **kwargs)
+
+
+class PlotPool:
+    """
+    Queues plot jobs (a plot function of this module with its arguments) that are rendered by a pool of background processes
+    with the Agg backend, so the caller does not wait for the plots and does not import matplotlib.
+    With a report the plots are saved as the pages of one multi-page PDF instead of separate files, in the order of the jobs
+    by one process. With 0 workers the plots are made in the calling process.
+    The pool is forked, the main scripts are not guarded against being imported again by spawn.
+    """
+    workers                     =   None
+    report_path                 =   None
+
+    def __init__(self, workers=PLOT_WORKERS, report_path=None):
+        """
+        param workers:          [opt] number of plot processes, 0 to plot in the calling process
+        param report_path:      [opt] filename of the multi-page PDF report, the plots are saved as separate files without it
+        """
+        super().__init__()
+        self.workers = max(0, int(workers))
+        self.report_path = report_path
+        self.jobs = []
+        self.pool = None
+        if self.workers == 0:
+            if report_path is not None:
+                open_report(report_path)
+        else:
+            # the pages of a report are written by one process
+            processes = 1 if report_path is not None else min(self.workers, os.cpu_count() or 1)
+            ctx = multiprocessing.get_context("fork")
+            self.pool = ctx.Pool(processes, initializer=init_plot_worker, initargs=(report_path, ))
+
+    def submit(self, plot_function, *args, **kwargs):
+        """
+        Queues a plot, e.g. submit(plot_track, save_path, data_dict, title)
+        """
+        if self.pool is None:
+            plot_function(*args, **kwargs)
+        else:
+            self.jobs.append(self.pool.apply_async(run_plot_job, (plot_function, args, kwargs)))
+
+    def close(self):
+        """
+        Waits until all plots are saved, closes the report and raises the first error of a plot job
+        """
+        if self.pool is None:
+            close_report()
+            return
+        try:
+            if self.report_path is not None:
+                self.jobs.append(self.pool.apply_async(close_report))
+            for job in self.jobs:
+                job.get()
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.jobs = []
 
 
 def plot_evaluation(save_path, xlabels, data_dict, title="", ylabel="", xlabel="", yticks=None, factor=1, vlines=[], show=False):
@@ -18,6 +122,7 @@ def plot_evaluation(save_path, xlabels, data_dict, title="", ylabel="", xlabel="
     returns:                saves the graph with the given filename
     """ 
     
+    import matplotlib.pyplot as plt
     plt.rcParams.update({'font.size': 14})
     x = np.arange(len(xlabels))
     width = 0.8
@@ -56,13 +161,56 @@ def plot_evaluation(save_path, xlabels, data_dict, title="", ylabel="", xlabel="
     fig.tight_layout()
     fig.set_size_inches(18.5, 10.5, forward=True)
     plt.subplots_adjust(left=0.05, right=0.98, top=0.92, bottom=0.05)
-    fig.savefig(save_path)
+    save_figure(fig, save_path)
     if show:
         plt.show()
     plt.close(fig)
     
 
-def plot_track(save_path, data_dict, title, fps=1, xlabel=None, ylabel=None, show=False):
+def plot_curves(save_path, x, data_dict, title, factor=1, xlabel=None, ylabel=None, show=False):
+    """
+    Plots a curve for every library in a separate graph for every key of the dictionary
+    param save_path:        the filename to where the plot is saved
+    param x:                the values on the x-axis, shared by all curves
+    param data_dict:        dictionary containing a key for each graph mapped on a dictionary of libraries and their curve
+    param title:            the title of the figure
+    param factor:           [opt] factor used to multiply the values
+    param xlabel:           [opt] label for the x-axis
+    param ylabel:           [opt] label for the y-axis
+    param show:             [opt] let the graph show and the program wait
+    returns:                saves the graph with the given filename
+    """
+    import matplotlib.pyplot as plt
+    plt.rcParams.update({'font.size': 14})
+    cols = int(np.ceil(np.sqrt(len(data_dict))))
+    rows = int(np.ceil(len(data_dict) / cols))
+    fig, axs = plt.subplots(rows, cols, sharex=True, sharey=True, squeeze=False)
+    fig.suptitle(title, fontsize=22)
+
+    keys = [d for d in data_dict]
+    for i in range(len(keys)):
+        k = keys[i]
+        ax = axs.flat[i]
+        for l in sorted(data_dict[k].keys()):
+            ax.plot(x, np.asarray(data_dict[k][l]) * factor, label=l)
+        ax.set_title(k, fontsize='small')
+    for ax in axs.flat[len(keys):]:
+        ax.set_visible(False)
+
+    for ax in axs.flat:
+        ax.set(xlabel=xlabel, ylabel=ylabel)
+        ax.label_outer()
+    axs.flat[0].legend(fontsize='small')
+
+    if show:
+        plt.show()
+    fig.set_size_inches(18.5, 10.5, forward=True)
+    plt.subplots_adjust(left=0.05, right=0.98, top=0.90, bottom=0.07, hspace=0.3)
+    save_figure(fig, save_path)
+    plt.close(fig)
+
+
+def plot_track(save_path, data_dict, title, fps=1, xlabel=None, ylabel=None, show=False, timestamps=None):
     """
     Plot the track of certain values in different graphs
     param save_path:        the filename to where the plot is saved
@@ -72,8 +220,10 @@ def plot_track(save_path, data_dict, title, fps=1, xlabel=None, ylabel=None, sho
     param xlabel:           [opt] label for the x-axis
     param ylabel:           [opt] label for the y-axis
     param show:             [opt] let the graph show and the program wait
+    param timestamps:       [opt] the time of every value (e.g. for frames that are not sampled uniformly), used instead of fps
     returns:                saves the graph with the given filename
     """ 
+    import matplotlib.pyplot as plt
     plt.rcParams.update({'font.size': 14})
     #fig, ax = plt.subplots()
     #ax.set_title(title)
@@ -84,7 +234,7 @@ def plot_track(save_path, data_dict, title, fps=1, xlabel=None, ylabel=None, sho
     for i in range(len(keys)):
         k = keys[i]
         d = data_dict[k]
-        x = np.arange(len(d))/fps
+        x = np.arange(len(d))/fps if timestamps is None else timestamps
         y_x = d[:,0]
         y_y = d[:,1]
 
@@ -132,11 +282,11 @@ def plot_track(save_path, data_dict, title, fps=1, xlabel=None, ylabel=None, sho
         plt.show()
     fig.set_size_inches(18.5, 10.5, forward=True)
     plt.subplots_adjust(left=0.05, right=0.95, top=0.90, bottom=0.07)
-    fig.savefig(save_path)
+    save_figure(fig, save_path)
     plt.close(fig)
 
 
-def plot_single_values(save_path, data_dict, title, fps=1, xlabel=None, ylabel=None, show=False): 
+def plot_single_values(save_path, data_dict, title, fps=1, xlabel=None, ylabel=None, show=False, timestamps=None): 
     """
     Plot the track of certain values in different graphs
     param save_path:        the filename to where the plot is saved
@@ -146,8 +296,10 @@ def plot_single_values(save_path, data_dict, title, fps=1, xlabel=None, ylabel=N
     param xlabel:           [opt] label for the x-axis
     param ylabel:           [opt] label for the y-axis
     param show:             [opt] let the graph show and the program wait
+    param timestamps:       [opt] the time of every value (e.g. for frames that are not sampled uniformly), used instead of fps
     returns:                saves the graph with the given filename
     """ 
+    import matplotlib.pyplot as plt
     plt.rcParams.update({'font.size': 14})
     fig, axs = plt.subplots(len(data_dict), sharex=True)
     fig.suptitle(title, fontsize=22)
@@ -155,8 +307,8 @@ def plot_single_values(save_path, data_dict, title, fps=1, xlabel=None, ylabel=N
     for i in range(len(keys)):
         k = keys[i]
         d = data_dict[k]
-        x = np.arange(len(d))/fps
-        axs[i].plot(x, d, label=d)
+        x = np.arange(len(d))/fps if timestamps is None else timestamps
+        axs[i].plot(x, d, label=k)
         axs[i].set_title(k)
     
     for ax in axs.flat:
@@ -168,5 +320,5 @@ def plot_single_values(save_path, data_dict, title, fps=1, xlabel=None, ylabel=N
     fig.set_size_inches(18.5, 10.5, forward=True)
     #fig.tight_layout()
     plt.subplots_adjust(left=0.05, right=0.95, top=0.90, bottom=0.07)
-    fig.savefig(save_path)
+    save_figure(fig, save_path)
     plt.close(fig)
\ No newline at end of file
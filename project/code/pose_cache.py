@@ -0,0 +1,137 @@
+import os
+import json
+import mmap
+import fcntl
+
+
+class PoseCache:
+    """
+    Append-only cache of the keypoints of one video.
+    Every line of the file holds the frame number and the keypoints of that frame as json: <frame_number>\t<json>\n
+    Opening the cache only indexes the offsets of the lines, the json of a frame is parsed when it is requested.
+    Every frame is written as soon as it is predicted, so an interrupted analysis can be resumed.
+    The file is locked while a writer has it open (the cache folder can be shared), a cache of which the file is locked
+    by another writer is read only and keeps the frames it predicts in memory.
+    """
+    path                        =   None
+    index                       =   None
+    read_only                   =   False
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.index = {}
+        self.read_only = False
+        self._memory = {}
+        self._file = None
+        self._reader = None
+        self._end = 0
+        if os.path.exists(self.path):
+            self.read_index()
+
+    def read_index(self):
+        """
+        Builds the index of frame number to the offset of the json, an incomplete last line (e.g. after a crash) is ignored
+        """
+        self.index = {}
+        self._end = 0
+        if os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while True:
+                    end = data.find(b"\n", offset)
+                    if end == -1:
+                        break
+                    tab = data.find(b"\t", offset, end)
+                    if tab != -1:
+                        self.index[int(data[offset:tab])] = (tab + 1, end)
+                    offset = end + 1
+        self._end = offset
+
+    def __contains__(self, frame_number):
+        return frame_number in self.index or frame_number in self._memory
+
+    def __len__(self):
+        return len(self.index) + len(self._memory)
+
+    def frames(self):
+        return sorted(list(self.index.keys()) + list(self._memory.keys()))
+
+    def get(self, frame_number):
+        """
+        :param frame_number:    the frame number
+        :return:                the keypoints dict of the frame (None if no person was detected)
+        """
+        if frame_number in self._memory:
+            return self._memory[frame_number]
+        start, end = self.index[frame_number]
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+        self._reader.seek(start)
+        return json.loads(self._reader.read(end - start))
+
+    def put(self, frame_number, kps):
+        """
+        Appends the keypoints of a frame to the cache file
+        :param frame_number:    the frame number
+        :param kps:             the keypoints dict of the frame or None
+        """
+        if self._file is None and not self.read_only:
+            self.open_writer()
+        if self.read_only:
+            self._memory[int(frame_number)] = kps
+            return
+        prefix = (str(int(frame_number)) + "\t").encode()
+        line = json.dumps(kps).encode()
+        self._file.write(prefix + line + b"\n")
+        self._file.flush()
+        start = self._end + len(prefix)
+        self.index[int(frame_number)] = (start, start + len(line))
+        self._end = start + len(line) + 1
+
+    def open_writer(self):
+        """
+        Opens and locks the file for appending, the index is read again because another writer can have added frames since
+        the cache was opened. If another writer has the lock the cache becomes read only.
+        """
+        folder = os.path.dirname(self.path)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+        f = open(self.path, "a+b")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            self.read_only = True
+            return
+        self.read_index()
+        # an incomplete last line of an interrupted writer is removed
+        f.truncate(self._end)
+        self._file = f
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+
+def convert_json_cache(json_path, cache_path):
+    """
+    Converts a pose cache with all frames in one json dict ({ "<frame_number>" : kps }) to a PoseCache file
+    :param json_path:       the json file
+    :param cache_path:      the filename of the new pose cache
+    :return:                the number of converted frames
+    """
+    with open(json_path) as json_file:
+        pose_kps = json.load(json_file)
+    cache = PoseCache(cache_path)
+    for key in sorted(pose_kps.keys()):
+        if int(key) not in cache:
+            cache.put(int(key), pose_kps[key])
+    cache.close()
+    return len(pose_kps)
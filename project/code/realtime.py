@@ -0,0 +1,178 @@
+import time
+import threading
+from collections import deque
+import cv2
+import numpy as np
+
+from constants import REALTIME_LATENCY_TARGET, REALTIME_LATENCY_WINDOW
+
+
+class LiveSource(threading.Thread):
+    """
+    Reads a camera, or a video at the speed of the wall clock as a stand-in for a camera, in a separate thread.
+    Only the newest frame is kept: a frame that is not taken before the next frame is read is dropped.
+    """
+    source                      =   None
+    fps                         =   None
+    start_time                  =   None
+    frames_read                 =   None
+    frames_dropped              =   None
+
+    def __init__(self, source):
+        """
+        :param source:          camera index (int) or path of a video
+        """
+        super().__init__(daemon=True)
+        self.source = source
+        self.is_camera = isinstance(source, int)
+        self.video_cap = cv2.VideoCapture(source)
+        self.fps = self.video_cap.get(cv2.CAP_PROP_FPS)
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.newest = None
+        self.ended = False
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+
+    def run(self):
+        self.start_time = time.time()
+        frame_number = 0
+        while not self.stopped.is_set():
+            if not self.is_camera:
+                # the frames of a video are available at the time they were recorded
+                delay = self.start_time + frame_number / self.fps - time.time()
+                if delay > 0 and self.stopped.wait(delay):
+                    break
+            ret, frame = self.video_cap.read()
+            if not ret:
+                break
+            capture_time = time.time()
+            timestamp = capture_time - self.start_time if self.is_camera else frame_number / self.fps
+            with self.condition:
+                if self.newest is not None:
+                    self.frames_dropped += 1
+                self.newest = (frame, frame_number, timestamp, capture_time)
+                self.frames_read += 1
+                self.condition.notify()
+            frame_number += 1
+        self.video_cap.release()
+        with self.condition:
+            self.ended = True
+            self.condition.notify()
+
+    def get(self):
+        """
+        Waits for a frame that was not returned before
+        :return:                frame, frame_number, timestamp, capture_time of the newest frame or None at the end of the source
+        """
+        with self.condition:
+            while self.newest is None and not self.ended:
+                self.condition.wait()
+            item, self.newest = self.newest, None
+            return item
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class RealtimeAnalyser:
+    """
+    Analyses a live source with a CycloDetector within a latency target (the time from the capture of a frame to its result).
+    The newest frame is always analysed next and the frames in between are dropped. A frame that is already older than the
+    latency target when the analysis is ready for it is dropped as stale. With skip_masks the mask inference (FRONT orientation)
+    is skipped when the age of the frame and the expected time of a frame with a mask exceed the latency target.
+    """
+    detector                    =   None
+    latency_target              =   None
+    skip_masks                  =   None
+    stats                       =   None
+
+    def __init__(self, detector, latency_target=REALTIME_LATENCY_TARGET, skip_masks=False):
+        """
+        :param detector:        CycloDetector that is set up with live=True
+        :param latency_target:  [opt] maximum time in seconds between the capture of a frame and its result
+        :param skip_masks:      [opt] skip the mask inference when the analysis is behind
+        """
+        super().__init__()
+        self.detector = detector
+        self.latency_target = latency_target
+        self.skip_masks = skip_masks
+
+    def run(self, source, duration=None):
+        """
+        Analyses the frames of a live source and yields the result of every analysed frame (see CycloDetector.analyse_frame)
+        with its latency. The statistics of the run are kept in stats (see report) and the running statistics of the
+        analysis in the summary of the detector.
+        :param source:          camera index or path of a video that is read at the speed of the wall clock
+        :param duration:        [opt] stop after this number of seconds, at the end of the source otherwise
+        """
+        live = LiveSource(source)
+        latencies = deque(maxlen=REALTIME_LATENCY_WINDOW)
+        self.stats = {"analysed" : 0, "stale" : 0, "masks_skipped" : 0, "no_person" : 0}
+        # expected time to analyse a frame with its mask, measured on the frames with a mask
+        mask_frame_time = 0.0
+        started = False
+        live.start()
+        start_time = time.time()
+        try:
+            while duration is None or time.time() - start_time < duration:
+                item = live.get()
+                if item is None:
+                    break
+                frame, frame_number, timestamp, capture_time = item
+                start = time.time()
+                if start - capture_time > self.latency_target:
+                    self.stats["stale"] += 1
+                    continue
+
+                # the mask of the first frame is only requested by start_analysis for an analysed area
+                get_mask_flag = started and self.detector.area_bool
+                if get_mask_flag and self.skip_masks and start - capture_time + mask_frame_time > self.latency_target:
+                    get_mask_flag = False
+                    self.stats["masks_skipped"] += 1
+                self.detector.frame_index = frame_number
+                self.detector.timestamp = timestamp
+                kps, mask = self.detector.get_frame_results(frame, get_kps_flag=True, get_mask_flag=get_mask_flag)
+                if kps is None:
+                    self.stats["no_person"] += 1
+                    continue
+                if not started:
+                    mask = self.detector.start_analysis(frame, kps)
+                    started = True
+
+                area_bool = self.detector.area_bool and mask is not None
+                res = self.detector.analyse_frame(frame, kps, mask, area_bool, self.detector.angles_to_track, self.detector.kps_to_track)
+                self.detector.summary.update(res)
+                end = time.time()
+                if mask is not None:
+                    mask_frame_time = end - start if mask_frame_time == 0.0 else 0.8 * mask_frame_time + 0.2 * (end - start)
+                res["latency"] = end - capture_time
+                latencies.append(res["latency"])
+                self.stats["analysed"] += 1
+                yield res
+        finally:
+            live.stop()
+            self.stats["time"] = time.time() - start_time
+            self.stats["read"] = live.frames_read
+            self.stats["dropped"] = live.frames_dropped
+            self.stats["latencies"] = np.array(latencies)
+
+    def report(self):
+        """
+        :return:                dict with the achieved fps, the number of read, analysed, dropped and stale frames,
+                                the number of skipped masks and the 50th, 90th and 99th percentile of the latency in seconds
+        """
+        latencies = self.stats["latencies"]
+        report = {
+            "fps"               :   self.stats["analysed"] / max(self.stats["time"], 1e-9),
+            "read"              :   self.stats["read"],
+            "analysed"          :   self.stats["analysed"],
+            "dropped"           :   self.stats["dropped"],
+            "stale"             :   self.stats["stale"],
+            "masks_skipped"     :   self.stats["masks_skipped"],
+            "no_person"         :   self.stats["no_person"],
+        }
+        for p in [50, 90, 99]:
+            report["latency_p" + str(p)] = np.percentile(latencies, p) if len(latencies) > 0 else np.nan
+        return report
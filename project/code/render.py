@@ -0,0 +1,164 @@
+import time
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+from vis import draw_angle
+from constants import PIPELINE_QUEUE_SIZE
+
+
+def render_frame(frame, kps, angles_to_track, title):
+    """
+    Draws the title and the tracked angles on a frame of the visualization
+    :return:                the frame with the visualization
+    """
+    cv2.putText(frame, title, (10, 50), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 0, 255), 1)
+    for angle in angles_to_track:
+        frame = draw_angle(angle, kps, frame)
+    return frame
+
+
+def render_worker(vis_path, fps, slots, items, free_slots, title, angles_to_track):
+    """
+    Renders the frames in the slots in order and writes them to a video (fps is not None) or an image, until None is received
+    """
+    writer = None
+    if fps is not None:
+        writer = cv2.VideoWriter(vis_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (slots.shape[2], slots.shape[1]))
+    try:
+        while True:
+            item = items.get()
+            if item is None:
+                break
+            slot, kps = item
+            frame = render_frame(slots[slot], kps, angles_to_track, title)
+            if writer is not None:
+                writer.write(frame)
+            else:
+                cv2.imwrite(vis_path, frame)
+            free_slots.release()
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def render_process(*args):
+    """
+    Main function of the render process, see render_worker
+    """
+    # the thread pool of OpenCV is not usable after a fork
+    cv2.setNumThreads(0)
+    render_worker(*args)
+
+
+class FrameRenderer:
+    """
+    Renders the visualization of the analysed frames (see render_frame) and writes it in a separate process, so the drawing
+    and the encoding of the video do not take time of the analysis. The frames are copied into a ring of slots in shared memory
+    and only the slot and the keypoints of a frame go through the queue. With every > 1 only every Nth frame is rendered,
+    the video is written at the rate of the rendered frames.
+    The process is forked, the main scripts are not guarded against being imported again by spawn. A worker of a pool
+    (see CycloComparer.analyse_parallel) can not start a process, there the frames are rendered in a thread of the worker.
+    """
+    vis_path                    =   None
+    every                       =   None
+    busy_time                   =   None
+    frames                      =   None
+    rendered                    =   None
+    error                       =   None
+
+    def __init__(self, vis_path, fps, shape, title, angles_to_track, every=1, n_slots=PIPELINE_QUEUE_SIZE):
+        """
+        :param vis_path:        filename of the visualization
+        :param fps:             analyse rate of the frames for a video, None for an image
+        :param shape:           shape of the frames
+        :param title:           text on the top left of every frame
+        :param angles_to_track: names of the angles that are drawn
+        :param every:           [opt] render every Nth frame
+        :param n_slots:         [opt] number of frames that can wait to be rendered
+        """
+        super().__init__()
+        self.vis_path = vis_path
+        self.every = max(1, int(every))
+        self.shape = tuple(shape)
+        self.n_slots = n_slots
+        self.busy_time = 0.0
+        self.frames = 0
+        self.rendered = 0
+        self.error = None
+        if fps is not None:
+            fps = fps / self.every
+        self.shm = None
+        if multiprocessing.current_process().daemon:
+            self.slots = np.empty((n_slots, ) + self.shape, dtype=np.uint8)
+            self.items = queue.Queue()
+            self.free_slots = threading.Semaphore(n_slots)
+            self.process = threading.Thread(target=self.render_thread, args=(vis_path, fps, self.slots, self.items, self.free_slots, title, angles_to_track), daemon=True)
+        else:
+            ctx = multiprocessing.get_context("fork")
+            self.shm = shared_memory.SharedMemory(create=True, size=n_slots * int(np.prod(self.shape)))
+            self.slots = np.ndarray((n_slots, ) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+            self.items = ctx.Queue()
+            self.free_slots = ctx.Semaphore(n_slots)
+            self.process = ctx.Process(target=render_process, args=(vis_path, fps, self.slots, self.items, self.free_slots, title, angles_to_track), daemon=True)
+        try:
+            self.process.start()
+        except Exception:
+            self.release()
+            raise
+
+    def render_thread(self, *args):
+        try:
+            render_worker(*args)
+        except Exception as e:
+            self.error = e
+
+    def check(self):
+        """
+        Raises the error of the renderer if it stopped with an error
+        """
+        if self.error is not None:
+            raise self.error
+        if isinstance(self.process, multiprocessing.process.BaseProcess) and self.process.exitcode not in [None, 0]:
+            raise RuntimeError("the render process of " + self.vis_path + " stopped with exit code " + str(self.process.exitcode))
+
+    def put(self, frame, kps):
+        """
+        Adds the next frame of the visualization, blocks while all slots are waiting to be rendered (backpressure)
+        :param frame:           the analysed frame, it is copied and not changed
+        :param kps:             keypoints of the frame
+        """
+        self.frames += 1
+        if (self.frames - 1) % self.every != 0:
+            return
+        start = time.time()
+        while not self.free_slots.acquire(timeout=0.1):
+            if not self.process.is_alive():
+                self.check()
+                raise RuntimeError("the renderer of " + self.vis_path + " stopped")
+        slot = self.rendered % self.n_slots
+        self.slots[slot] = frame
+        self.items.put((slot, kps))
+        self.rendered += 1
+        self.busy_time += time.time() - start
+
+    def close(self):
+        """
+        Waits until all frames are rendered and written, and releases the shared memory
+        """
+        try:
+            self.items.put(None)
+            self.process.join()
+        finally:
+            self.release()
+        self.check()
+
+    def release(self):
+        self.slots = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+
+from constants import ROI_MARGIN, ROI_BORDER
+
+
+def roi_from_results(kps, mask, frame_shape, margin=ROI_MARGIN):
+    """
+    Calculates the region of interest for the next frame around the keypoints and the mask of a frame
+    :param kps:             keypoints dict (or None)
+    :param mask:            one channel mask (or None)
+    :param frame_shape:     shape of the frame
+    :param margin:          [opt] margin added on every side, as a fraction of the width and height of the box
+    :return:                box (x1, y1, x2, y2) clipped to the frame, or None if there is nothing to track
+    """
+    xs, ys = [], []
+    if kps is not None:
+        # the points at (0, 0) are keypoints that are not predicted
+        for kp in kps:
+            if kps[kp][0] > 0 or kps[kp][1] > 0:
+                xs.append(kps[kp][0])
+                ys.append(kps[kp][1])
+    if mask is not None:
+        points = cv2.findNonZero(mask)
+        if points is not None:
+            x, y, w, h = cv2.boundingRect(points)
+            xs += [x, x + w]
+            ys += [y, y + h]
+    if len(xs) == 0:
+        return None
+
+    height, width = frame_shape[:2]
+    x1, x2, y1, y2 = min(xs), max(xs), min(ys), max(ys)
+    mx, my = margin * (x2 - x1), margin * (y2 - y1)
+    x1 = int(max(0, np.floor(x1 - mx)))
+    y1 = int(max(0, np.floor(y1 - my)))
+    x2 = int(min(width, np.ceil(x2 + mx)))
+    y2 = int(min(height, np.ceil(y2 + my)))
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None
+    return x1, y1, x2, y2
+
+
+def crop(img, roi):
+    x1, y1, x2, y2 = roi
+    return img[y1:y2, x1:x2]
+
+
+def shift_keypoints(kps, roi):
+    """
+    Maps keypoints that are predicted on a crop back to the coordinates of the full frame
+    :param kps:             keypoints dict with [x, y, c] points (or None)
+    :param roi:             box (x1, y1, x2, y2) of the crop
+    :return:                keypoints dict in the coordinates of the frame
+    """
+    if kps is None:
+        return None
+    x1, y1 = roi[:2]
+    return {kp : [kps[kp][0] + x1, kps[kp][1] + y1] + list(kps[kp][2:]) for kp in kps}
+
+
+def paste_mask(mask, roi, frame_shape):
+    """
+    Maps a mask that is predicted on a crop back to a mask of the full frame
+    :param mask:            one channel mask of the crop
+    :param roi:             box (x1, y1, x2, y2) of the crop
+    :param frame_shape:     shape of the frame
+    :return:                one channel mask of the frame
+    """
+    x1, y1, x2, y2 = roi
+    full = np.zeros(frame_shape[:2], dtype=mask.dtype)
+    full[y1:y2, x1:x2] = mask
+    return full
+
+
+def touches_border(box, roi, frame_shape, border=ROI_BORDER):
+    """
+    Checks if a box that is predicted on a crop touches a side of the crop that is not a side of the frame,
+    in that case the person is probably cut off by the crop
+    :param box:             box (x1, y1, x2, y2) in the coordinates of the crop
+    :param roi:             box (x1, y1, x2, y2) of the crop
+    :param frame_shape:     shape of the frame
+    :param border:          [opt] distance in pixels to a side that counts as touching
+    :return:                True if the box touches an inner side of the crop
+    """
+    x1, y1, x2, y2 = box
+    rx1, ry1, rx2, ry2 = roi
+    height, width = frame_shape[:2]
+    return  (rx1 > 0 and x1 <= border) or \
+            (ry1 > 0 and y1 <= border) or \
+            (rx2 < width and x2 >= rx2 - rx1 - border) or \
+            (ry2 < height and y2 >= ry2 - ry1 - border)
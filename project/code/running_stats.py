@@ -0,0 +1,185 @@
+import copy
+import numpy as np
+
+
+class RunningStats:
+    """
+    Mean and standard deviation of a stream of (weighted) values in constant memory (Welford's algorithm).
+    A value can be a number or an array, arrays are accumulated element wise (e.g. the x and y of a keypoint).
+    The mean and the standard deviation of an empty stream are NaN.
+    """
+    count                       =   None
+    weight                      =   None
+    mean                        =   None
+    m2                          =   None
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.weight = 0.0
+        self.mean = np.nan
+        self.m2 = 0.0
+
+    def update(self, value, weight=1.0):
+        """
+        :param value:           the next value
+        :param weight:          [opt] weight of the value, e.g. the time that a frame represents
+        """
+        value = np.asarray(value, dtype=float)
+        if self.count == 0:
+            self.mean = np.zeros_like(value)
+        self.count += 1
+        self.weight += weight
+        delta = value - self.mean
+        self.mean = self.mean + delta * weight / self.weight
+        self.m2 = self.m2 + weight * delta * (value - self.mean)
+
+    def std(self):
+        """
+        :return:                the (population, weighted) standard deviation of the values so far, like np.std
+        """
+        if self.count == 0:
+            return np.nan
+        return np.sqrt(self.m2 / self.weight)
+
+
+class PointSpread:
+    """
+    Center of a stream of (weighted) points rounded to pixels, and the mean, standard deviation and maximum of the distances
+    of the points to the center. The total weight of every distinct position is kept instead of the points, so the distances
+    to the current center are calculated without a second pass over the points.
+    This is deliberately not constant memory: the center moves with every point, so the exact distances need the positions,
+    and the number of distinct positions grows with the movement of the keypoint (at most the number of points).
+    """
+    positions                   =   None
+    weight                      =   None
+    total                       =   None
+
+    def __init__(self):
+        super().__init__()
+        self.positions = {}
+        self.weight = 0.0
+        self.total = np.zeros(2)
+
+    def update(self, point, weight=1.0):
+        """
+        :param point:           x, y of the next point
+        :param weight:          [opt] weight of the point, e.g. the time that a frame represents
+        """
+        position = (float(point[0]), float(point[1]))
+        self.positions[position] = self.positions.get(position, 0.0) + weight
+        self.weight += weight
+        self.total = self.total + weight * np.array(position)
+
+    def center(self):
+        """
+        :return:                [x, y] of the (weighted) mean of the points so far
+        """
+        if self.weight == 0:
+            return [np.nan, np.nan]
+        return [self.total[0] / self.weight, self.total[1] / self.weight]
+
+    def values(self):
+        """
+        :return:                dict with the center, the (weighted) mean and std of the distances of the points to the center
+                                and the maximum distance
+        """
+        center = self.center()
+        if len(self.positions) == 0:
+            return {"center" : center, "mean" : np.nan, "std" : np.nan, "max" : np.nan}
+        points = np.array(list(self.positions.keys()))
+        weights = np.array(list(self.positions.values()))
+        d = center - points
+        dist = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+        mean = np.average(dist, weights=weights)
+        std = np.sqrt(np.average((dist - mean)**2, weights=weights))
+        return {"center" : center, "mean" : mean, "std" : std, "max" : np.max(dist)}
+
+
+class AnalysisSummary:
+    """
+    Running statistics of the analysed frames of a file, updated with the result of every frame (see CycloDetector.iter_analyse).
+    With weighted every frame is weighted by the time it represents: half of the interval between the previous and the next frame,
+    the interval to the neighbouring frame for the first and the last frame. The weight of a frame is known when the next frame
+    is added, so the last frame is kept pending and is added with the interval to the previous frame in values.
+    """
+    frames                      =   None
+    timestamp                   =   None
+    area                        =   None
+    area_interest               =   None
+    angles                      =   None
+    kps                         =   None
+    weighted                    =   False
+    pending                     =   None
+    previous_timestamp          =   None
+
+    def __init__(self, area_bool, angles_to_track, kps_to_track, weighted=False):
+        """
+        :param area_bool:       the area of the mask is analysed
+        :param angles_to_track: names of the tracked angles
+        :param kps_to_track:    names of the tracked keypoints
+        :param weighted:        [opt] weight the frames by the time they represent (motion-adaptive sampling)
+        """
+        super().__init__()
+        self.weighted = weighted
+        self.frames = 0
+        if area_bool:
+            self.area = RunningStats()
+            self.area_interest = RunningStats()
+        self.angles = {angle : RunningStats() for angle in angles_to_track}
+        self.kps = {kp : PointSpread() for kp in kps_to_track}
+
+    def update(self, res):
+        """
+        :param res:             the result of a frame (see CycloDetector.analyse_frame)
+        """
+        self.frames += 1
+        self.timestamp = res["timestamp"]
+        # only the values of the statistics are kept, not the keypoints of the frame
+        frame = {key : res[key] for key in ["timestamp", "area", "area_interest", "angles_to_track", "kps_to_track"] if key in res}
+        if not self.weighted:
+            self.add(frame, 1.0)
+            return
+        if self.pending is not None:
+            # half of the interval between the previous and the next frame, the interval to the next frame for the first frame
+            if self.previous_timestamp is None:
+                weight = frame["timestamp"] - self.pending["timestamp"]
+            else:
+                weight = (frame["timestamp"] - self.previous_timestamp) / 2
+            self.add(self.pending, weight)
+            self.previous_timestamp = self.pending["timestamp"]
+        self.pending = frame
+
+    def add(self, frame, weight):
+        # the area is missing when the mask of a frame was skipped (see RealtimeAnalyser)
+        if self.area is not None and "area" in frame:
+            self.area.update(frame["area"], weight)
+            self.area_interest.update(frame["area_interest"], weight)
+        for angle, value in zip(self.angles, frame["angles_to_track"]):
+            self.angles[angle].update(value, weight)
+        for kp, point in zip(self.kps, frame["kps_to_track"]):
+            self.kps[kp].update(point, weight)
+
+    def values(self):
+        """
+        :return:                dict with the number of frames, the timestamp of the last frame, the mean and std of the area,
+                                the mean and std of every angle and the center and the mean, std and maximum of the distances
+                                to the center of every tracked keypoint (see PointSpread)
+        """
+        summary = self
+        if self.pending is not None:
+            # the last frame represents the interval to the previous frame (a single frame has weight 1)
+            summary = copy.deepcopy(self)
+            summary.add(self.pending, 1.0 if self.previous_timestamp is None else self.pending["timestamp"] - self.previous_timestamp)
+
+        values = {"frames" : self.frames, "timestamp" : self.timestamp, "area" : None}
+        if summary.area is not None:
+            values["area"] = {
+                "AREA_MEAN"             :   summary.area.mean,
+                "AREA_STD"              :   summary.area.std(),
+                "AREA_INTEREST_MEAN"    :   summary.area_interest.mean,
+                "AREA_INTEREST_STD"     :   summary.area_interest.std(),
+            }
+        values["angles"] = {angle : {"mean" : summary.angles[angle].mean, "std" : summary.angles[angle].std()} for angle in summary.angles}
+        values["kps"] = {kp : summary.kps[kp].values() for kp in summary.kps}
+        return values